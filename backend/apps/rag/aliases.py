@@ -0,0 +1,56 @@
+import json
+import os
+import threading
+
+
+def load_json(path: str) -> dict:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_json(path: str, data: dict):
+    # written aside and renamed, a crash never leaves a half written file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class CollectionAliases:
+    """
+    Persistent map of collection name -> Chroma collection currently serving it.
+
+    Documents keep the collection name they were stored under, re-embedding one
+    writes a new (shadow) collection and switches the alias to it in one step.
+    Names without an alias are served by the collection of the same name.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._aliases = load_json(path)
+
+    def resolve(self, collection_name: str) -> str:
+        with self._lock:
+            return self._aliases.get(collection_name, collection_name)
+
+    def items(self) -> dict:
+        with self._lock:
+            return dict(self._aliases)
+
+    def set(self, collection_name: str, target: str):
+        with self._lock:
+            aliases = {**self._aliases, collection_name: target}
+            self._save(aliases)
+            self._aliases = aliases
+
+    def clear(self):
+        with self._lock:
+            self._save({})
+            self._aliases = {}
+
+    def _save(self, aliases: dict):
+        save_json(self.path, aliases)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+import argparse
+import json
+import mimetypes
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from chromadb.utils import embedding_functions
+
+from apps.rag.embeddings import (
+    EMBEDDING_BACKEND,
+    SentenceTransformerEmbedder,
+    exact_top_k,
+    normalize_rows,
+)
+from apps.rag.utils import load_and_split
+
+DEFAULT_QUERIES = [
+    "what is the main topic of this document",
+    "summary of the key findings",
+    "revenue and margin figures",
+    "risks and limitations",
+    "next steps and recommendations",
+]
+
+
+def _timed(fn, texts):
+    start = time.perf_counter()
+    vectors = np.asarray(fn(texts), dtype=np.float32)
+    return vectors, time.perf_counter() - start
+
+
+def load_texts(paths, chunk_size: int, chunk_overlap: int) -> list:
+    texts = []
+    for path in paths:
+        for file_path in [path] if path.is_file() else path.rglob("*"):
+            if file_path.is_file() and not file_path.name.startswith("."):
+                chunks, _ = load_and_split(
+                    file_path.name,
+                    mimetypes.guess_type(file_path)[0],
+                    str(file_path),
+                    chunk_size,
+                    chunk_overlap,
+                )
+                texts.extend(chunks)
+    return texts
+
+
+def benchmark(
+    texts: list,
+    queries: list,
+    model_name: str,
+    quantization: str,
+    threads: int,
+    batch_size: int,
+    k: int,
+) -> dict:
+    """
+    Embeds the same chunks with chroma's SentenceTransformerEmbeddingFunction (what the
+    RAG app used before) and the onnx_int8 backend. Reports chunks/sec and query latency
+    of each, the cosine similarity between their vectors and recall@k of the int8
+    backend against the full precision results.
+    """
+    reference = embedding_functions.SentenceTransformerEmbeddingFunction(
+        model_name=model_name, device="cpu"
+    )
+    with tempfile.TemporaryDirectory() as onnx_dir:
+        start = time.perf_counter()
+        onnx = SentenceTransformerEmbedder(
+            model_name,
+            batch_size=batch_size,
+            backend=EMBEDDING_BACKEND.ONNX_INT8,
+            onnx_dir=onnx_dir,
+            onnx_quantization=quantization,
+            onnx_threads=threads,
+        )
+        export_seconds = time.perf_counter() - start
+
+        results = {}
+        vectors = {}
+        for name, fn in [("sentence_transformers", reference), ("onnx_int8", onnx)]:
+            document_vectors, elapsed = _timed(fn, texts)
+            query_vectors, query_elapsed = _timed(
+                lambda queries: [fn([query])[0] for query in queries], queries
+            )
+            vectors[name] = (document_vectors, query_vectors)
+            results[name] = {
+                "chunks": len(texts),
+                "chunks_per_sec": len(texts) / elapsed,
+                "query_latency_ms": query_elapsed / len(queries) * 1000,
+            }
+        results["onnx_int8"]["export_seconds"] = export_seconds
+
+    reference_documents, reference_queries = vectors["sentence_transformers"]
+    onnx_documents, onnx_queries = vectors["onnx_int8"]
+    similarities = np.sum(
+        normalize_rows(reference_documents) * normalize_rows(onnx_documents), axis=1
+    )
+    overlaps = [
+        len(set(expected) & set(actual)) / k
+        for expected, actual in zip(
+            exact_top_k(reference_documents, reference_queries, k),
+            exact_top_k(onnx_documents, onnx_queries, k),
+        )
+    ]
+    results["onnx_int8"].update(
+        {
+            "mean_cosine_similarity": float(np.mean(similarities)),
+            "min_cosine_similarity": float(np.min(similarities)),
+            f"recall@{k}_vs_sentence_transformers": float(np.mean(overlaps)),
+            "speedup": results["onnx_int8"]["chunks_per_sec"]
+            / results["sentence_transformers"]["chunks_per_sec"],
+        }
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the onnx_int8 embedding backend with SentenceTransformerEmbeddingFunction"
+    )
+    parser.add_argument("paths", nargs="+", type=Path, help="documents or directories")
+    parser.add_argument(
+        "--model",
+        default=os.environ.get("RAG_EMBEDDING_MODEL", "all-MiniLM-L6-v2"),
+    )
+    parser.add_argument("--quantization", default="avx2")
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--chunk-size", type=int, default=1500)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--queries", nargs="+", default=DEFAULT_QUERIES)
+    parser.add_argument("-k", type=int, default=4)
+    args = parser.parse_args()
+
+    texts = load_texts(args.paths, args.chunk_size, args.chunk_overlap)
+    if len(texts) == 0:
+        raise ValueError(f"no text found in {args.paths}")
+
+    results = benchmark(
+        texts,
+        args.queries,
+        args.model,
+        args.quantization,
+        args.threads,
+        args.batch_size,
+        args.k,
+    )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import os
+import re
+import threading
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Persistent chunk embedding cache for one embedding model, keyed by the
+    sha256 of the chunk text.
+
+    Vectors live in a memory-mapped float32 matrix (`vectors.f32`), `index.txt`
+    holds one hash per line, line n being row n. Both are append only: vectors
+    are flushed before their hashes are appended, so the index never points
+    past the written rows.
+    """
+
+    def __init__(self, path: str, dimension: int, max_rows: int):
+        self.path = path
+        self.dimension = dimension
+        self.max_rows = max_rows
+        self.vectors_path = f"{path}/vectors.f32"
+        self.index_path = f"{path}/index.txt"
+        Path(path).mkdir(parents=True, exist_ok=True)
+
+        self.rows = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                for row, line in enumerate(f):
+                    self.rows[line.strip()] = row
+
+        self.capacity = 0
+        self._vectors = None
+        if os.path.exists(self.vectors_path):
+            self._open(os.path.getsize(self.vectors_path) // (dimension * 4))
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _open(self, capacity: int):
+        self.capacity = capacity
+        self._vectors = (
+            np.memmap(
+                self.vectors_path,
+                dtype=np.float32,
+                mode="r+",
+                shape=(capacity, self.dimension),
+            )
+            if capacity
+            else None
+        )
+
+    def _reserve(self, rows: int):
+        if rows <= self.capacity:
+            return
+        # grow geometrically, remapping the file is not free
+        capacity = min(max(rows, self.capacity * 2, 1024), self.max_rows)
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(capacity * self.dimension * 4)
+        self._open(capacity)
+
+    def get_many(self, hashes: List[str]) -> Tuple[np.ndarray, List[int]]:
+        """
+        Returns:
+            (embeddings, missing): the cached rows, and the positions of the
+            hashes that are not cached and whose rows are left empty
+        """
+        embeddings = np.zeros((len(hashes), self.dimension), dtype=np.float32)
+        with self._lock:
+            found = [
+                (i, self.rows[sha256])
+                for i, sha256 in enumerate(hashes)
+                if sha256 in self.rows
+            ]
+            if found:
+                positions, rows = zip(*found)
+                embeddings[list(positions)] = self._vectors[list(rows)]
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+
+        found_positions = {i for i, _ in found}
+        missing = [i for i in range(len(hashes)) if i not in found_positions]
+        return embeddings, missing
+
+    def put_many(self, hashes: List[str], embeddings: np.ndarray):
+        with self._lock:
+            new = {}
+            for sha256, embedding in zip(hashes, embeddings):
+                if sha256 not in self.rows and sha256 not in new:
+                    new[sha256] = embedding
+            # full: keep serving what is cached, stop adding
+            new = dict(list(new.items())[: max(0, self.max_rows - len(self.rows))])
+            if not new:
+                return
+
+            start = len(self.rows)
+            self._reserve(start + len(new))
+            self._vectors[start : start + len(new)] = np.stack(list(new.values()))
+            self._vectors.flush()
+
+            with open(self.index_path, "a") as f:
+                f.write("".join(f"{sha256}\n" for sha256 in new))
+            for row, sha256 in enumerate(new, start):
+                self.rows[sha256] = row
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "rows": len(self.rows),
+                "max_rows": self.max_rows,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+def get_embedding_cache_path(cache_dir: str, model_name: str, dimension: int) -> str:
+    # one directory per model and dimension, model names may contain slashes
+    sanitized_model_name = re.sub(r"[^\w.-]", "_", model_name)
+    return f"{cache_dir}/{sanitized_model_name}-{dimension}"
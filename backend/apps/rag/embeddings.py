@@ -0,0 +1,220 @@
+import os
+import re
+import threading
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+from sentence_transformers import SentenceTransformer
+
+
+class EMBEDDING_BACKEND:
+    # full precision PyTorch, on RAG_EMBEDDING_MODEL_DEVICE_TYPE
+    TORCH = "torch"
+    # same model exported to ONNX Runtime with dynamic int8 quantization, CPU only
+    ONNX_INT8 = "onnx_int8"
+
+
+def load_onnx_int8_model(
+    model_name: str, onnx_dir: str, quantization: str, threads: int
+) -> SentenceTransformer:
+    """
+    Exports the model to ONNX and quantizes its weights to int8 once, later
+    calls load the quantized model from `onnx_dir`.
+
+    Parameters:
+        quantization: target instruction set, "avx2", "avx512", "avx512_vnni" or "arm64"
+        threads: ONNX Runtime intra-op threads, 0 lets it use every core
+    """
+    import onnxruntime
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    sanitized_model_name = re.sub(r"[^\w.-]", "_", model_name)
+    path = f"{onnx_dir}/{sanitized_model_name}"
+    file_name = f"onnx/model_qint8_{quantization}.onnx"
+    if not os.path.exists(f"{path}/{file_name}"):
+        model = SentenceTransformer(model_name, device="cpu", backend="onnx")
+        model.save(path)
+        export_dynamic_quantized_onnx_model(model, quantization, path)
+
+    session_options = onnxruntime.SessionOptions()
+    session_options.intra_op_num_threads = threads
+    return SentenceTransformer(
+        path,
+        device="cpu",
+        backend="onnx",
+        model_kwargs={
+            "file_name": file_name,
+            "provider": "CPUExecutionProvider",
+            "session_options": session_options,
+        },
+    )
+
+
+def get_embedding_model_name(embedding_id: str) -> str:
+    # embedding ids are "<model>" or "<model>@<backend>-<quantization>"
+    return embedding_id.split("@")[0]
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact_top_k(
+    document_vectors: np.ndarray, query_vectors: np.ndarray, k: int
+) -> np.ndarray:
+    """
+    Indices of the `k` documents closest to each query. Used by the embedding
+    benchmarks: exact cosine search, so recall only reflects the embedding model.
+    """
+    scores = normalize_rows(query_vectors) @ normalize_rows(document_vectors).T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+class SentenceTransformerEmbedder(EmbeddingFunction):
+    """
+    Drop-in replacement for chroma's SentenceTransformerEmbeddingFunction that
+    controls how chunks are encoded instead of leaving it to Chroma.
+
+    Texts are sorted by length and encoded in fixed size batches, so each batch
+    pads to similar lengths and memory stays bounded on large documents. With
+    `processes` > 1 large inputs are spread over a multi-process pool, one
+    process per target device.
+
+    The onnx_int8 backend runs the same model quantized on ONNX Runtime, it
+    parallelizes with `onnx_threads` instead of processes.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        device: str = "cpu",
+        batch_size: int = 32,
+        processes: int = 0,
+        backend: str = EMBEDDING_BACKEND.TORCH,
+        onnx_dir: Optional[str] = None,
+        onnx_quantization: str = "avx2",
+        onnx_threads: int = 0,
+    ):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.backend = backend
+        if backend == EMBEDDING_BACKEND.ONNX_INT8:
+            self.device = "cpu"
+            self.processes = 0
+            self.model = load_onnx_int8_model(
+                model_name, onnx_dir, onnx_quantization, onnx_threads
+            )
+            # int8 vectors differ slightly, they are cached apart from full precision ones
+            self.embedding_id = f"{model_name}@{backend}-{onnx_quantization}"
+        else:
+            self.device = device
+            self.processes = processes
+            self.model = SentenceTransformer(model_name, device=device)
+            self.embedding_id = model_name
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+        self._pool = None
+        self._lock = threading.Lock()
+        # encode calls in flight, the pool is only stopped once they are all done
+        self._active = 0
+        self._closing = False
+        self.stats = {"chunks": 0, "seconds": 0.0}
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        return self.encode(input).tolist()
+
+    def encode(
+        self, texts: List[str], progress: Optional[Callable] = None
+    ) -> np.ndarray:
+        """
+        Parameters:
+            progress: called with (encoded, total) after every batch
+
+        Returns:
+            float32 matrix with one row per text, in the order of `texts`
+        """
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        if not texts:
+            return embeddings
+
+        start = time.perf_counter()
+        # longest first, every batch then holds texts of about the same length
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+
+        with self._lock:
+            self._active += 1
+        try:
+            if self.processes > 1 and len(texts) >= self.batch_size * self.processes:
+                embeddings[order] = self.model.encode_multi_process(
+                    [texts[i] for i in order],
+                    self._get_pool(),
+                    batch_size=self.batch_size,
+                )
+                if progress:
+                    progress(len(texts), len(texts))
+            else:
+                for offset in range(0, len(order), self.batch_size):
+                    batch = order[offset : offset + self.batch_size]
+                    embeddings[batch] = self.model.encode(
+                        [texts[i] for i in batch],
+                        batch_size=len(batch),
+                        convert_to_numpy=True,
+                        show_progress_bar=False,
+                    )
+                    if progress:
+                        progress(offset + len(batch), len(texts))
+        finally:
+            with self._lock:
+                self._active -= 1
+                if self._closing and self._active == 0:
+                    self._stop_pool()
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.stats["chunks"] += len(texts)
+            self.stats["seconds"] += elapsed
+        if len(texts) >= self.batch_size:
+            print(
+                f"Embedded {len(texts)} chunks with {self.embedding_id} in {elapsed:.2f}s "
+                f"({len(texts) / elapsed:.1f} chunks/sec)"
+            )
+        return embeddings
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            chunks, seconds = self.stats["chunks"], self.stats["seconds"]
+        return {
+            "embedding_model": self.model_name,
+            "backend": self.backend,
+            "device": self.device,
+            "batch_size": self.batch_size,
+            "processes": self.processes,
+            "chunks": chunks,
+            "seconds": round(seconds, 3),
+            "chunks_per_second": round(chunks / seconds, 2) if seconds else None,
+        }
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = self.model.start_multi_process_pool(
+                    target_devices=[self.device] * self.processes
+                )
+            return self._pool
+
+    def _stop_pool(self):
+        if self._pool is not None:
+            self.model.stop_multi_process_pool(self._pool)
+            self._pool = None
+
+    def close(self):
+        """
+        Stops the multi-process pool once the encode calls in flight are done,
+        e.g. ingestion jobs still holding this embedder after a model update.
+        """
+        with self._lock:
+            self._closing = True
+            if self._active == 0:
+                self._stop_pool()
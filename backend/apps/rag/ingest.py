@@ -0,0 +1,185 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+
+class JOB_STATUS:
+    QUEUED = "queued"
+    PARSING = "parsing"
+    EMBEDDING = "embedding"
+    WRITING = "writing"
+    DONE = "done"
+    FAILED = "failed"
+
+
+FINISHED_STATUSES = {JOB_STATUS.DONE, JOB_STATUS.FAILED}
+
+
+class IngestionJob:
+    def __init__(
+        self, collection_name: str, filename: str, user_id: str, payload: dict
+    ):
+        self.id = str(uuid.uuid4())
+        self.collection_name = collection_name
+        self.filename = filename
+        self.user_id = user_id
+        self.payload = payload
+
+        self.status = JOB_STATUS.QUEUED
+        self.progress = 0.0
+        self.chunks = None
+        self.chunks_per_second = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        # bumped on every update so event streams only send changes
+        self.version = 0
+        self._finished_event = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def update(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+        self.updated_at = time.time()
+        self.version += 1
+        if self.finished:
+            self._finished_event.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until the job is done or failed.
+
+        Returns:
+            False if it is still running after `timeout` seconds
+        """
+        return self._finished_event.wait(timeout)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "collection_name": self.collection_name,
+            "filename": self.filename,
+            "status": self.status,
+            "progress": round(self.progress, 4),
+            "chunks": self.chunks,
+            "chunks_per_second": (
+                round(self.chunks_per_second, 2) if self.chunks_per_second else None
+            ),
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class IngestionQueue:
+    """
+    Runs document ingestion outside of the HTTP request, as a pipeline of three
+    stages with their own worker pool: parse (load + split), embed and write to Chroma.
+
+    Each stage function receives the job and the previous stage's result and
+    returns the input of the next one, so a slow stage (embedding a 300 page PDF)
+    only holds up the jobs queued behind it in that stage.
+    """
+
+    def __init__(
+        self,
+        parse: Callable,
+        embed: Callable,
+        write: Callable,
+        parse_workers: int = 2,
+        embed_workers: int = 1,
+        write_workers: int = 1,
+        max_finished_jobs: int = 1000,
+        format_error: Callable = str,
+    ):
+        self.stages = [
+            (
+                JOB_STATUS.PARSING,
+                parse,
+                ThreadPoolExecutor(parse_workers, thread_name_prefix="rag-parse"),
+            ),
+            (
+                JOB_STATUS.EMBEDDING,
+                embed,
+                ThreadPoolExecutor(embed_workers, thread_name_prefix="rag-embed"),
+            ),
+            (
+                JOB_STATUS.WRITING,
+                write,
+                ThreadPoolExecutor(write_workers, thread_name_prefix="rag-write"),
+            ),
+        ]
+        self.max_finished_jobs = max_finished_jobs
+        # turns a stage's exception into the message reported to the client
+        self.format_error = format_error
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(
+        self, collection_name: str, filename: str, user_id: str, **payload
+    ) -> IngestionJob:
+        job = IngestionJob(collection_name, filename, user_id, payload)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._schedule(job, 0, None)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[: max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+
+    def _schedule(self, job: IngestionJob, stage: int, data):
+        _, _, executor = self.stages[stage]
+        executor.submit(self._run_stage, job, stage, data)
+
+    def _run_stage(self, job: IngestionJob, stage: int, data):
+        status, fn, _ = self.stages[stage]
+        job.update(status=status)
+        try:
+            result = fn(job, data)
+        except Exception as e:
+            print(e)
+            job.update(status=JOB_STATUS.FAILED, error=self.format_error(e), payload={})
+            return
+
+        if stage + 1 < len(self.stages):
+            self._schedule(job, stage + 1, result)
+        else:
+            job.update(status=JOB_STATUS.DONE, progress=1.0, payload={})
+
+    def shutdown(self):
+        for _, _, executor in self.stages:
+            executor.shutdown(wait=False, cancel_futures=True)
+        # cancelled stages never finish their jobs, release whoever waits on them
+        with self._lock:
+            for job in self._jobs.values():
+                if not job.finished:
+                    job.update(status=JOB_STATUS.FAILED, error="shutting down")
+
+
+async def job_event_stream(job: IngestionJob, poll_interval: float = 0.25):
+    """
+    Server-sent events with the job state, sent whenever it changes until the job finishes
+    """
+    version = -1
+    while True:
+        if job.version != version:
+            version = job.version
+            yield f"data: {json.dumps(job.to_dict())}\n\n"
+            if job.finished:
+                return
+        await asyncio.sleep(poll_interval)
@@ -8,36 +8,35 @@ from fastapi import (
     Form,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 import os, shutil
 
 from pathlib import Path
 from typing import List
 
 from sentence_transformers import SentenceTransformer
-from chromadb.utils import embedding_functions
-
-from langchain_community.document_loaders import (
-    WebBaseLoader,
-    TextLoader,
-    PyPDFLoader,
-    CSVLoader,
-    Docx2txtLoader,
-    UnstructuredEPubLoader,
-    UnstructuredWordDocumentLoader,
-    UnstructuredMarkdownLoader,
-    UnstructuredXMLLoader,
-    UnstructuredRSTLoader,
-    UnstructuredExcelLoader,
-)
+
+from langchain_community.document_loaders import WebBaseLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 from pydantic import BaseModel
 from typing import Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections import OrderedDict
+import multiprocessing
+import heapq
 import mimetypes
+import threading
+import time
 import uuid
 import json
 
 
+from apps.rag.aliases import CollectionAliases, load_json, save_json
+from apps.rag.embedding_cache import EmbeddingCache, get_embedding_cache_path
+from apps.rag.embeddings import SentenceTransformerEmbedder, get_embedding_model_name
+from apps.rag.ingest import JOB_STATUS, IngestionQueue, job_event_stream
+from apps.rag.utils import get_loader, load_and_split
 from apps.web.models.documents import (
     Documents,
     DocumentForm,
@@ -47,19 +46,39 @@ from apps.web.models.documents import (
 from utils.misc import (
     calculate_sha256,
     calculate_sha256_string,
+    save_file_and_calculate_sha256,
     sanitize_filename,
     extract_folders_after_data_docs,
 )
 from utils.utils import get_current_user, get_admin_user
 from config import (
+    DATA_DIR,
     UPLOAD_DIR,
     DOCS_DIR,
+    CACHE_DIR,
     RAG_EMBEDDING_MODEL,
     RAG_EMBEDDING_MODEL_DEVICE_TYPE,
+    RAG_EMBEDDING_BATCH_SIZE,
+    RAG_EMBEDDING_PROCESSES,
+    RAG_EMBEDDING_BACKEND,
+    RAG_EMBEDDING_ONNX_DIR,
+    RAG_EMBEDDING_ONNX_QUANTIZATION,
+    RAG_EMBEDDING_ONNX_THREADS,
+    RAG_EMBEDDING_CACHE_ENABLED,
+    RAG_EMBEDDING_CACHE_DIR,
+    RAG_EMBEDDING_CACHE_MAX_ROWS,
     CHROMA_CLIENT,
     CHUNK_SIZE,
     CHUNK_OVERLAP,
     RAG_TEMPLATE,
+    RAG_INGEST_PARSE_WORKERS,
+    RAG_INGEST_EMBED_WORKERS,
+    RAG_INGEST_WRITE_WORKERS,
+    RAG_SCAN_WORKERS,
+    RAG_QUERY_WORKERS,
+    RAG_QUERY_EMBEDDING_CACHE_SIZE,
+    RAG_COLLECTION_CACHE_SIZE,
+    RAG_REINDEX_BATCH_SIZE,
 )
 
 from constants import ERROR_MESSAGES
@@ -81,13 +100,79 @@ app.state.RAG_TEMPLATE = RAG_TEMPLATE
 app.state.RAG_EMBEDDING_MODEL = RAG_EMBEDDING_MODEL
 app.state.TOP_K = 4
 
-app.state.sentence_transformer_ef = (
-    embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name=app.state.RAG_EMBEDDING_MODEL,
+
+def get_embedding_function(model_name: str) -> SentenceTransformerEmbedder:
+    return SentenceTransformerEmbedder(
+        model_name=model_name,
         device=RAG_EMBEDDING_MODEL_DEVICE_TYPE,
+        batch_size=RAG_EMBEDDING_BATCH_SIZE,
+        processes=RAG_EMBEDDING_PROCESSES,
+        backend=RAG_EMBEDDING_BACKEND,
+        onnx_dir=RAG_EMBEDDING_ONNX_DIR,
+        onnx_quantization=RAG_EMBEDDING_ONNX_QUANTIZATION,
+        onnx_threads=RAG_EMBEDDING_ONNX_THREADS,
     )
+
+
+# Model chosen with /embedding/model/update, it outlives restarts and takes
+# precedence over RAG_EMBEDDING_MODEL once set
+EMBEDDING_MODEL_STATE_PATH = f"{DATA_DIR}/rag_embedding_model.json"
+embedding_model_state = load_json(EMBEDDING_MODEL_STATE_PATH)
+
+
+def save_embedding_model_state():
+    save_json(
+        EMBEDDING_MODEL_STATE_PATH,
+        {
+            "embedding_model": app.state.RAG_EMBEDDING_MODEL,
+            "legacy_embedding_id": app.state.legacy_embedding_id,
+        },
+    )
+
+
+try:
+    app.state.sentence_transformer_ef = get_embedding_function(
+        embedding_model_state.get("embedding_model", RAG_EMBEDDING_MODEL)
+    )
+except Exception as e:
+    # collections keep resolving their own model, see get_collection_embedding_function
+    print(e)
+    app.state.sentence_transformer_ef = get_embedding_function(RAG_EMBEDDING_MODEL)
+app.state.RAG_EMBEDDING_MODEL = app.state.sentence_transformer_ef.model_name
+# Every model some collection is still served with, several during a model update
+app.state.embedding_functions = {
+    app.state.sentence_transformer_ef.embedding_id: app.state.sentence_transformer_ef
+}
+embedding_functions_lock = threading.Lock()
+embedding_function_load_locks = {}
+# model -> why it could not be loaded, for the collections still embedded with it
+app.state.embedding_function_errors = {}
+# Model of the collections created before they were tagged with theirs
+app.state.legacy_embedding_id = embedding_model_state.get(
+    "legacy_embedding_id", app.state.sentence_transformer_ef.embedding_id
 )
 
+# (model, dimension) -> EmbeddingCache
+app.state.embedding_caches = {}
+embedding_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(ef) -> Optional[EmbeddingCache]:
+    if not RAG_EMBEDDING_CACHE_ENABLED:
+        return None
+
+    key = (ef.embedding_id, ef.dimension)
+    with embedding_caches_lock:
+        if key not in app.state.embedding_caches:
+            app.state.embedding_caches[key] = EmbeddingCache(
+                get_embedding_cache_path(
+                    RAG_EMBEDDING_CACHE_DIR, ef.embedding_id, ef.dimension
+                ),
+                ef.dimension,
+                RAG_EMBEDDING_CACHE_MAX_ROWS,
+            )
+        return app.state.embedding_caches[key]
+
 
 origins = ["*"]
 
@@ -108,7 +193,178 @@ class StoreWebForm(CollectionNameForm):
     url: str
 
 
-def store_data_in_vector_db(data, collection_name) -> bool:
+class QueryEmbeddingCache:
+    """
+    LRU of query embeddings keyed by (embedding model, query), so regenerations and
+    one prompt sent to several documents skip model inference
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._embeddings = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _build_key(model_name: str, query: str) -> tuple:
+        # whitespace differences do not change the query
+        return (model_name, " ".join(query.split()))
+
+    def get(self, model_name: str, query: str):
+        key = self._build_key(model_name, query)
+        with self._lock:
+            embedding = self._embeddings.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._embeddings.move_to_end(key)
+            return embedding
+
+    def set(self, model_name: str, query: str, embedding):
+        with self._lock:
+            self._embeddings[self._build_key(model_name, query)] = embedding
+            while len(self._embeddings) > self.max_size:
+                self._embeddings.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._embeddings.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._embeddings),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+app.state.query_embedding_cache = QueryEmbeddingCache(RAG_QUERY_EMBEDDING_CACHE_SIZE)
+
+
+def embed_query(query: str, ef=None):
+    ef = ef if ef else app.state.sentence_transformer_ef
+    embedding = app.state.query_embedding_cache.get(ef.embedding_id, query)
+    if embedding is None:
+        embedding = ef([query])[0]
+        app.state.query_embedding_cache.set(ef.embedding_id, query, embedding)
+    return embedding
+
+
+class CollectionCache:
+    """
+    LRU of Chroma collection handles keyed by (collection, embedding model).
+    get_collection reloads the collection metadata and binds the embedding
+    function on every call, hot documents are looked up once.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._collections = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, collection_name: str, ef):
+        key = (collection_name, ef.embedding_id)
+        with self._lock:
+            collection = self._collections.get(key)
+            if collection is not None:
+                self._collections.move_to_end(key)
+                return collection
+
+        # raises when the collection does not exist, misses are not cached
+        collection = CHROMA_CLIENT.get_collection(
+            name=collection_name,
+            embedding_function=ef,
+        )
+        with self._lock:
+            self._collections[key] = collection
+            while len(self._collections) > self.max_size:
+                self._collections.popitem(last=False)
+        return collection
+
+    def invalidate(self, collection_name: Optional[str] = None):
+        """Drops the handles of one collection, or all of them"""
+        with self._lock:
+            if collection_name == None:
+                self._collections.clear()
+                return
+            for key in [key for key in self._collections if key[0] == collection_name]:
+                del self._collections[key]
+
+
+app.state.collection_cache = CollectionCache(RAG_COLLECTION_CACHE_SIZE)
+app.state.collection_aliases = CollectionAliases(f"{DATA_DIR}/vector_db_aliases.json")
+
+
+def get_collection(collection_name: str):
+    return app.state.collection_cache.get(
+        app.state.collection_aliases.resolve(collection_name),
+        app.state.sentence_transformer_ef,
+    )
+
+
+def get_collection_embedding_id(collection) -> str:
+    return (collection.metadata or {}).get(
+        "embedding_model", app.state.legacy_embedding_id
+    )
+
+
+def find_embedding_function(model_name: str):
+    # torch and onnx_int8 vectors of one model are the same space, within the precision
+    # benchmark_embeddings.py measures, so either backend serves the collection
+    if app.state.sentence_transformer_ef.model_name == model_name:
+        return app.state.sentence_transformer_ef
+    for ef in app.state.embedding_functions.values():
+        if ef.model_name == model_name:
+            return ef
+    return None
+
+
+def get_collection_embedding_function(collection):
+    """
+    The model the collection's vectors were made with, queries must use the same.
+    Loaded on first use when it is not the current one, e.g. after a restart in
+    the middle of a model update. Raises when it cannot be loaded, the failure
+    is remembered until the next model update instead of retried on every query.
+    """
+    model_name = get_embedding_model_name(get_collection_embedding_id(collection))
+    with embedding_functions_lock:
+        ef = find_embedding_function(model_name)
+        error = app.state.embedding_function_errors.get(model_name)
+        model_lock = embedding_function_load_locks.setdefault(
+            model_name, threading.Lock()
+        )
+
+    if ef is None and error is None:
+        # loaded outside of the global lock, queries on other collections go on meanwhile
+        with model_lock:
+            with embedding_functions_lock:
+                ef = find_embedding_function(model_name)
+                error = app.state.embedding_function_errors.get(model_name)
+            if ef is None and error is None:
+                try:
+                    ef = get_embedding_function(model_name)
+                    with embedding_functions_lock:
+                        app.state.embedding_functions[ef.embedding_id] = ef
+                except Exception as e:
+                    error = str(e)
+                    with embedding_functions_lock:
+                        app.state.embedding_function_errors[model_name] = error
+
+    if ef is None:
+        raise ValueError(
+            f"{collection.name} was embedded with {model_name}, "
+            f"which cannot be loaded: {error}"
+        )
+    return ef
+
+
+def split_documents(data):
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=app.state.CHUNK_SIZE, chunk_overlap=app.state.CHUNK_OVERLAP
     )
@@ -116,25 +372,128 @@ def store_data_in_vector_db(data, collection_name) -> bool:
 
     texts = [doc.page_content for doc in docs]
     metadatas = [doc.metadata for doc in docs]
+    return texts, metadatas
+
+
+def embed_texts(texts, progress=None, ef=None):
+    # explicit, length sorted batches, Chroma receives the embeddings precomputed
+    ef = ef if ef else app.state.sentence_transformer_ef
+    cache = get_embedding_cache(ef)
+    if cache == None:
+        return ef.encode(texts, progress).tolist()
+
+    # only chunks never seen before with this model go through the model
+    hashes = [calculate_sha256_string(text) for text in texts]
+    embeddings, missing = cache.get_many(hashes)
+    cached = len(texts) - len(missing)
+
+    def encode_progress(encoded, total):
+        if progress:
+            progress(cached + encoded, len(texts))
+
+    if missing:
+        embeddings[missing] = ef.encode([texts[i] for i in missing], encode_progress)
+        cache.put_many([hashes[i] for i in missing], embeddings[missing])
+    else:
+        encode_progress(0, 0)
+
+    if texts:
+        print(
+            f"Embedding cache: {cached}/{len(texts)} chunks cached, "
+            f"hit rate {cache.get_stats()['hit_rate']}"
+        )
+    return embeddings.tolist()
+
+
+def write_to_vector_db(collection_name, texts, metadatas, embeddings, embedding_id):
+    # re-embedded before, now served by its shadow collection
+    if app.state.collection_aliases.resolve(collection_name) != collection_name:
+        return
 
     try:
         collection = CHROMA_CLIENT.create_collection(
             name=collection_name,
             embedding_function=app.state.sentence_transformer_ef,
+            metadata={"embedding_model": embedding_id},
         )
+    except Exception as e:
+        # same document stored before
+        if e.__class__.__name__ == "UniqueConstraintError":
+            return
+        raise e
+
+    collection.add(
+        documents=texts,
+        metadatas=metadatas,
+        embeddings=embeddings,
+        ids=[str(uuid.uuid1()) for _ in texts],
+    )
+
 
-        collection.add(
-            documents=texts, metadatas=metadatas, ids=[str(uuid.uuid1()) for _ in texts]
+def store_data_in_vector_db(data, collection_name) -> bool:
+    try:
+        texts, metadatas = split_documents(data)
+        ef = app.state.sentence_transformer_ef
+        write_to_vector_db(
+            collection_name,
+            texts,
+            metadatas,
+            embed_texts(texts, ef=ef),
+            ef.embedding_id,
         )
         return True
     except Exception as e:
         print(e)
-        if e.__class__.__name__ == "UniqueConstraintError":
-            return True
-
         return False
 
 
+def parse_job(job, _):
+    loader, _ = get_loader(
+        job.filename, job.payload["content_type"], job.payload["file_path"]
+    )
+    texts, metadatas = split_documents(loader.load())
+    job.update(chunks=len(texts), progress=0.2)
+    return texts, metadatas
+
+
+def embed_job(job, data):
+    texts, metadatas = data
+    start = time.perf_counter()
+
+    def progress(encoded, total):
+        elapsed = time.perf_counter() - start
+        job.update(
+            progress=0.2 + 0.7 * encoded / total,
+            chunks_per_second=encoded / elapsed if elapsed else None,
+        )
+
+    # the model may change before the write stage, the collection records this one
+    ef = app.state.sentence_transformer_ef
+    embeddings = embed_texts(texts, progress, ef)
+    return texts, metadatas, embeddings, ef.embedding_id
+
+
+def write_job(job, data):
+    write_to_vector_db(job.collection_name, *data)
+
+
+def get_ingestion_error_message(e) -> str:
+    if "No pandoc was found" in str(e):
+        return ERROR_MESSAGES.PANDOC_NOT_INSTALLED
+    return ERROR_MESSAGES.DEFAULT(e)
+
+
+app.state.ingestion_queue = IngestionQueue(
+    parse=parse_job,
+    embed=embed_job,
+    write=write_job,
+    parse_workers=RAG_INGEST_PARSE_WORKERS,
+    embed_workers=RAG_INGEST_EMBED_WORKERS,
+    write_workers=RAG_INGEST_WRITE_WORKERS,
+    format_error=get_ingestion_error_message,
+)
+
+
 @app.get("/")
 async def get_status():
     return {
@@ -158,21 +517,206 @@ class EmbeddingModelUpdateForm(BaseModel):
     embedding_model: str
 
 
+class EMBEDDING_MODEL_UPDATE_STATUS:
+    LOADING = "loading"
+    REINDEXING = "reindexing"
+    DONE = "done"
+    FAILED = "failed"
+
+
+app.state.embedding_model_update = None
+embedding_model_update_lock = threading.Lock()
+
+
+def list_logical_collection_names() -> list:
+    aliases = app.state.collection_aliases.items()
+    targets = set(aliases.values())
+    # chroma returns names or Collection objects depending on the version
+    names = [
+        collection if isinstance(collection, str) else collection.name
+        for collection in CHROMA_CLIENT.list_collections()
+    ]
+    return sorted({name for name in names if name not in targets} | set(aliases))
+
+
+def reindex_collection(collection_name: str, ef) -> str:
+    """
+    Copies the collection into a shadow collection embedded with `ef`, page by page,
+    then points the collection name at the shadow. Queries keep using the current
+    collection and its model until then. Collections are written once, when their
+    document is stored, so nothing is missed by copying it while it serves queries.
+
+    Returns:
+        The name of the retired collection, to delete once nothing uses it
+    """
+    collection = get_collection(collection_name)
+    shadow_name = f"{collection_name[:46]}-{uuid.uuid4().hex[:16]}"
+    shadow = CHROMA_CLIENT.create_collection(
+        name=shadow_name,
+        embedding_function=ef,
+        metadata={**(collection.metadata or {}), "embedding_model": ef.embedding_id},
+    )
+
+    try:
+        offset = 0
+        while True:
+            batch = collection.get(
+                include=["documents", "metadatas"],
+                limit=RAG_REINDEX_BATCH_SIZE,
+                offset=offset,
+            )
+            if not batch["ids"]:
+                break
+            shadow.add(
+                ids=batch["ids"],
+                documents=batch["documents"],
+                metadatas=batch["metadatas"],
+                embeddings=embed_texts(batch["documents"], ef=ef),
+            )
+            offset += len(batch["ids"])
+    except Exception as e:
+        CHROMA_CLIENT.delete_collection(name=shadow_name)
+        raise e
+
+    # the switch: from here on the name resolves to the shadow collection
+    app.state.collection_aliases.set(collection_name, shadow_name)
+    return collection.name
+
+
+def activate_embedding_function(ef):
+    # New documents are embedded with the new model from here on, existing
+    # collections are served with the model they were embedded with until switched
+    with embedding_functions_lock:
+        app.state.embedding_functions[ef.embedding_id] = ef
+        # models that failed to load get another chance
+        app.state.embedding_function_errors.clear()
+    app.state.sentence_transformer_ef = ef
+    app.state.RAG_EMBEDDING_MODEL = ef.model_name
+    save_embedding_model_state()
+
+
+def run_embedding_model_update(model_name: str):
+    update = app.state.embedding_model_update
+    try:
+        # load and warm up the new model while the current one keeps serving,
+        # a model that cannot be loaded fails the update and changes nothing
+        ef = get_embedding_function(model_name)
+        ef(["warm up"])
+        activate_embedding_function(ef)
+        update.update(status=EMBEDDING_MODEL_UPDATE_STATUS.REINDEXING)
+
+        retired = []
+        failed = set()
+        while True:
+            # again until nothing is left, in case documents embedded by the
+            # previous model were still being written when the update started
+            pending = [
+                collection_name
+                for collection_name in list_logical_collection_names()
+                if collection_name not in failed
+                and collection_name not in retired
+                and get_embedding_model_name(
+                    get_collection_embedding_id(get_collection(collection_name))
+                )
+                != ef.model_name
+            ]
+            if not pending:
+                break
+
+            update.update(total=update["reindexed"] + len(pending))
+            for collection_name in pending:
+                try:
+                    retired.append(reindex_collection(collection_name, ef))
+                    update.update(reindexed=update["reindexed"] + 1)
+                except Exception as e:
+                    print(e)
+                    failed.add(collection_name)
+                    update.update(failed=sorted(failed))
+
+        for collection_name in retired:
+            try:
+                CHROMA_CLIENT.delete_collection(name=collection_name)
+                app.state.collection_cache.invalidate(collection_name)
+            except Exception as e:
+                print(e)
+
+        # previous models are still needed to serve the collections that failed
+        if not failed:
+            app.state.legacy_embedding_id = ef.embedding_id
+            save_embedding_model_state()
+            with embedding_functions_lock:
+                for embedding_id, previous_ef in list(
+                    app.state.embedding_functions.items()
+                ):
+                    if embedding_id != ef.embedding_id:
+                        del app.state.embedding_functions[embedding_id]
+                        previous_ef.close()
+
+        update.update(status=EMBEDDING_MODEL_UPDATE_STATUS.DONE)
+    except Exception as e:
+        print(e)
+        update.update(status=EMBEDDING_MODEL_UPDATE_STATUS.FAILED, error=str(e))
+
+
 @app.post("/embedding/model/update")
 async def update_embedding_model(
     form_data: EmbeddingModelUpdateForm, user=Depends(get_admin_user)
 ):
-    app.state.RAG_EMBEDDING_MODEL = form_data.embedding_model
-    app.state.sentence_transformer_ef = (
-        embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name=app.state.RAG_EMBEDDING_MODEL,
-            device=RAG_EMBEDDING_MODEL_DEVICE_TYPE,
-        )
-    )
+    with embedding_model_update_lock:
+        update = app.state.embedding_model_update
+        if update and update["status"] in {
+            EMBEDDING_MODEL_UPDATE_STATUS.LOADING,
+            EMBEDDING_MODEL_UPDATE_STATUS.REINDEXING,
+        }:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=ERROR_MESSAGES.DEFAULT(
+                    f"Already updating to {update['embedding_model']}"
+                ),
+            )
+        app.state.embedding_model_update = {
+            "embedding_model": form_data.embedding_model,
+            "status": EMBEDDING_MODEL_UPDATE_STATUS.LOADING,
+            "total": None,
+            "reindexed": 0,
+            "failed": [],
+            "error": None,
+        }
+
+    # the new model is loaded and collections re-embedded in the background,
+    # the current model keeps serving until each collection is switched.
+    # Progress and failures (status "failed" and the error) are reported by
+    # GET /embedding/model/update
+    threading.Thread(
+        target=run_embedding_model_update,
+        args=(form_data.embedding_model,),
+        daemon=True,
+    ).start()
 
     return {
         "status": True,
         "embedding_model": app.state.RAG_EMBEDDING_MODEL,
+        "update": app.state.embedding_model_update,
+    }
+
+
+@app.get("/embedding/model/update")
+async def get_embedding_model_update(user=Depends(get_admin_user)):
+    return {
+        "status": True,
+        "embedding_model": app.state.RAG_EMBEDDING_MODEL,
+        "update": app.state.embedding_model_update,
+    }
+
+
+@app.get("/embedding/stats")
+async def get_embedding_stats(user=Depends(get_admin_user)):
+    cache = get_embedding_cache(app.state.sentence_transformer_ef)
+    return {
+        "status": True,
+        **app.state.sentence_transformer_ef.get_stats(),
+        "cache": cache.get_stats() if cache else None,
+        "query_cache": app.state.query_embedding_cache.get_stats(),
     }
 
 
@@ -248,12 +792,10 @@ def query_doc(
 ):
     try:
         # if you use docker use the model from the environment variable
-        collection = CHROMA_CLIENT.get_collection(
-            name=form_data.collection_name,
-            embedding_function=app.state.sentence_transformer_ef,
-        )
+        collection = get_collection(form_data.collection_name)
+        ef = get_collection_embedding_function(collection)
         result = collection.query(
-            query_texts=[form_data.query],
+            query_embeddings=[embed_query(form_data.query, ef)],
             n_results=form_data.k if form_data.k else app.state.TOP_K,
         )
         return result
@@ -272,35 +814,26 @@ class QueryCollectionsForm(BaseModel):
 
 
 def merge_and_sort_query_results(query_results, k):
-    # Initialize lists to store combined data
-    combined_ids = []
-    combined_distances = []
-    combined_metadatas = []
-    combined_documents = []
-
-    # Combine data from each dictionary
-    for data in query_results:
-        combined_ids.extend(data["ids"][0])
-        combined_distances.extend(data["distances"][0])
-        combined_metadatas.extend(data["metadatas"][0])
-        combined_documents.extend(data["documents"][0])
-
-    # Create a list of tuples (distance, id, metadata, document)
-    combined = list(
-        zip(combined_distances, combined_ids, combined_metadatas, combined_documents)
+    # Top k by distance across every result, without concatenating and sorting it all
+    combined = heapq.nsmallest(
+        k,
+        (
+            item
+            for data in query_results
+            for item in zip(
+                data["distances"][0],
+                data["ids"][0],
+                data["metadatas"][0],
+                data["documents"][0],
+            )
+        ),
+        key=lambda item: item[0],
     )
 
-    # Sort the list based on distances
-    combined.sort(key=lambda x: x[0])
-
-    # Unzip the sorted list
-    sorted_distances, sorted_ids, sorted_metadatas, sorted_documents = zip(*combined)
-
-    # Slicing the lists to include only k elements
-    sorted_distances = list(sorted_distances)[:k]
-    sorted_ids = list(sorted_ids)[:k]
-    sorted_metadatas = list(sorted_metadatas)[:k]
-    sorted_documents = list(sorted_documents)[:k]
+    # Unzip the top k, keeping empty lists when nothing matched
+    sorted_distances, sorted_ids, sorted_metadatas, sorted_documents = (
+        [list(values) for values in zip(*combined)] if combined else [[], [], [], []]
+    )
 
     # Create the output dictionary
     merged_query_results = {
@@ -316,32 +849,39 @@ def merge_and_sort_query_results(query_results, k):
     return merged_query_results
 
 
+query_executor = ThreadPoolExecutor(RAG_QUERY_WORKERS, thread_name_prefix="rag-query")
+
+
 @app.post("/query/collection")
 def query_collection(
     form_data: QueryCollectionsForm,
     user=Depends(get_current_user),
 ):
-    results = []
+    k = form_data.k if form_data.k else app.state.TOP_K
+    # embedded once for every collection, the LRU serves the concurrent lookups below.
+    # Collections not yet re-embedded during a model update get their own model's embedding
+    embed_query(form_data.query)
 
-    for collection_name in form_data.collection_names:
+    def query(collection_name):
         try:
             # if you use docker use the model from the environment variable
-            collection = CHROMA_CLIENT.get_collection(
-                name=collection_name,
-                embedding_function=app.state.sentence_transformer_ef,
+            collection = get_collection(collection_name)
+            ef = get_collection_embedding_function(collection)
+            return collection.query(
+                query_embeddings=[embed_query(form_data.query, ef)], n_results=k
             )
+        except Exception as e:
+            print(e)
+            return None
 
-            result = collection.query(
-                query_texts=[form_data.query],
-                n_results=form_data.k if form_data.k else app.state.TOP_K,
-            )
-            results.append(result)
-        except:
-            pass
+    # collections are searched concurrently, latency is the slowest one, not the sum
+    results = [
+        result
+        for result in query_executor.map(query, form_data.collection_names)
+        if result != None
+    ]
 
-    return merge_and_sort_query_results(
-        results, form_data.k if form_data.k else app.state.TOP_K
-    )
+    return merge_and_sort_query_results(results, k)
 
 
 @app.post("/web")
@@ -369,93 +909,11 @@ def store_web(form_data: StoreWebForm, user=Depends(get_current_user)):
         )
 
 
-def get_loader(filename: str, file_content_type: str, file_path: str):
-    file_ext = filename.split(".")[-1].lower()
-    known_type = True
-
-    known_source_ext = [
-        "go",
-        "py",
-        "java",
-        "sh",
-        "bat",
-        "ps1",
-        "cmd",
-        "js",
-        "ts",
-        "css",
-        "cpp",
-        "hpp",
-        "h",
-        "c",
-        "cs",
-        "sql",
-        "log",
-        "ini",
-        "pl",
-        "pm",
-        "r",
-        "dart",
-        "dockerfile",
-        "env",
-        "php",
-        "hs",
-        "hsc",
-        "lua",
-        "nginxconf",
-        "conf",
-        "m",
-        "mm",
-        "plsql",
-        "perl",
-        "rb",
-        "rs",
-        "db2",
-        "scala",
-        "bash",
-        "swift",
-        "vue",
-        "svelte",
-    ]
-
-    if file_ext == "pdf":
-        loader = PyPDFLoader(file_path)
-    elif file_ext == "csv":
-        loader = CSVLoader(file_path)
-    elif file_ext == "rst":
-        loader = UnstructuredRSTLoader(file_path, mode="elements")
-    elif file_ext == "xml":
-        loader = UnstructuredXMLLoader(file_path)
-    elif file_ext == "md":
-        loader = UnstructuredMarkdownLoader(file_path)
-    elif file_content_type == "application/epub+zip":
-        loader = UnstructuredEPubLoader(file_path)
-    elif (
-        file_content_type
-        == "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-        or file_ext in ["doc", "docx"]
-    ):
-        loader = Docx2txtLoader(file_path)
-    elif file_content_type in [
-        "application/vnd.ms-excel",
-        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    ] or file_ext in ["xls", "xlsx"]:
-        loader = UnstructuredExcelLoader(file_path)
-    elif file_ext in known_source_ext or (
-        file_content_type and file_content_type.find("text/") >= 0
-    ):
-        loader = TextLoader(file_path)
-    else:
-        loader = TextLoader(file_path)
-        known_type = False
-
-    return loader, known_type
-
-
 @app.post("/doc")
 def store_doc(
     collection_name: Optional[str] = Form(None),
     file: UploadFile = File(...),
+    background: bool = Form(False),
     user=Depends(get_current_user),
 ):
     # "https://www.gutenberg.org/files/1727/1727-h/1727-h.htm"
@@ -464,106 +922,242 @@ def store_doc(
     try:
         filename = file.filename
         file_path = f"{UPLOAD_DIR}/{filename}"
-        contents = file.file.read()
-        with open(file_path, "wb") as f:
-            f.write(contents)
-            f.close()
-
-        f = open(file_path, "rb")
+        # a single pass over the upload both saves and hashes it
+        sha256 = save_file_and_calculate_sha256(file.file, file_path)
         if collection_name == None:
-            collection_name = calculate_sha256(f)[:63]
-        f.close()
+            collection_name = sha256[:63]
 
-        loader, known_type = get_loader(file.filename, file.content_type, file_path)
-        data = loader.load()
-        result = store_data_in_vector_db(data, collection_name)
+        _, known_type = get_loader(file.filename, file.content_type, file_path)
 
-        if result:
+        # stored before: reuse the collection, nothing to parse or embed
+        if collection_exists(collection_name):
             return {
                 "status": True,
+                "job_id": None,
                 "collection_name": collection_name,
                 "filename": filename,
                 "known_type": known_type,
             }
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=ERROR_MESSAGES.DEFAULT(),
-            )
+
+        # parsing, embedding and writing happen in the ingestion queue,
+        # progress is available from /doc/jobs/{job_id}/events
+        job = app.state.ingestion_queue.submit(
+            collection_name,
+            filename,
+            user.id,
+            file_path=file_path,
+            content_type=file.content_type,
+        )
+
+        # the web UI ingests in the background and follows the job events,
+        # otherwise the collection exists when the response arrives
+        if not background:
+            job.wait()
+            if job.status == JOB_STATUS.FAILED:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=job.error,
+                )
+
+        return {
+            "status": True,
+            "job_id": job.id,
+            "collection_name": collection_name,
+            "filename": filename,
+            "known_type": known_type,
+        }
+    except HTTPException as e:
+        raise e
     except Exception as e:
         print(e)
-        if "No pandoc was found" in str(e):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=ERROR_MESSAGES.PANDOC_NOT_INSTALLED,
-            )
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=ERROR_MESSAGES.DEFAULT(e),
-            )
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=get_ingestion_error_message(e),
+        )
+
+
+def get_ingestion_job_or_404(job_id: str, user):
+    job = app.state.ingestion_queue.get(job_id)
+    if job == None or (job.user_id != user.id and user.role != "admin"):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=ERROR_MESSAGES.NOT_FOUND,
+        )
+    return job
+
+
+@app.get("/doc/jobs/{job_id}")
+def get_ingestion_job(job_id: str, user=Depends(get_current_user)):
+    return get_ingestion_job_or_404(job_id, user).to_dict()
+
+
+@app.get("/doc/jobs/{job_id}/events")
+def get_ingestion_job_events(job_id: str, user=Depends(get_current_user)):
+    job = get_ingestion_job_or_404(job_id, user)
+    return StreamingResponse(job_event_stream(job), media_type="text/event-stream")
+
+
+SCAN_MANIFEST_PATH = f"{CACHE_DIR}/rag/scan_manifest.json"
+
+
+def load_scan_manifest() -> dict:
+    try:
+        with open(SCAN_MANIFEST_PATH, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_scan_manifest(manifest: dict):
+    Path(SCAN_MANIFEST_PATH).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{SCAN_MANIFEST_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, SCAN_MANIFEST_PATH)
+
+
+def reset_scan_manifest():
+    if os.path.exists(SCAN_MANIFEST_PATH):
+        os.unlink(SCAN_MANIFEST_PATH)
+
+
+def collection_exists(collection_name: str) -> bool:
+    try:
+        get_collection(collection_name)
+        return True
+    except Exception:
+        return False
+
+
+def hash_path(path: Path) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            return calculate_sha256(f)
+    except Exception as e:
+        print(e)
+        return None
+
+
+def register_scanned_doc(user, path: Path, collection_name: str):
+    tags = extract_folders_after_data_docs(path)
+    filename = path.name
+    sanitized_filename = sanitize_filename(filename)
+    doc = Documents.get_doc_by_name(sanitized_filename)
+
+    if doc == None:
+        doc = Documents.insert_new_doc(
+            user.id,
+            DocumentForm(
+                **{
+                    "name": sanitized_filename,
+                    "title": filename,
+                    "collection_name": collection_name,
+                    "filename": filename,
+                    "content": (
+                        json.dumps(
+                            {"tags": list(map(lambda name: {"name": name}, tags))}
+                        )
+                        if len(tags)
+                        else "{}"
+                    ),
+                }
+            ),
+        )
 
 
 @app.get("/scan")
 def scan_docs_dir(user=Depends(get_admin_user)):
+    # path -> size, mtime, sha256 and collection of every file stored by a previous scan
+    manifest = load_scan_manifest()
+    scanned = {}
+
+    # Unchanged size and mtime: already stored, skip without reading the file
+    changed = []
     for path in Path(DOCS_DIR).rglob("./**/*"):
         try:
             if path.is_file() and not path.name.startswith("."):
-                tags = extract_folders_after_data_docs(path)
-                filename = path.name
-                file_content_type = mimetypes.guess_type(path)
-
-                f = open(path, "rb")
-                collection_name = calculate_sha256(f)[:63]
-                f.close()
-
-                loader, known_type = get_loader(
-                    filename, file_content_type[0], str(path)
-                )
-                data = loader.load()
-
-                result = store_data_in_vector_db(data, collection_name)
-
-                if result:
-                    sanitized_filename = sanitize_filename(filename)
-                    doc = Documents.get_doc_by_name(sanitized_filename)
-
-                    if doc == None:
-                        doc = Documents.insert_new_doc(
-                            user.id,
-                            DocumentForm(
-                                **{
-                                    "name": sanitized_filename,
-                                    "title": filename,
-                                    "collection_name": collection_name,
-                                    "filename": filename,
-                                    "content": (
-                                        json.dumps(
-                                            {
-                                                "tags": list(
-                                                    map(
-                                                        lambda name: {"name": name},
-                                                        tags,
-                                                    )
-                                                )
-                                            }
-                                        )
-                                        if len(tags)
-                                        else "{}"
-                                    ),
-                                }
-                            ),
-                        )
+                stat = path.stat()
+                entry = manifest.get(str(path))
+                if (
+                    entry
+                    and entry["size"] == stat.st_size
+                    and entry["mtime"] == stat.st_mtime_ns
+                ):
+                    scanned[str(path)] = entry
+                    register_scanned_doc(user, path, entry["collection_name"])
+                else:
+                    changed.append((path, stat))
+        except Exception as e:
+            print(e)
 
+    # Touched or new files: hashing is I/O bound and hashlib releases the GIL
+    with ThreadPoolExecutor(RAG_SCAN_WORKERS) as executor:
+        hashes = list(executor.map(hash_path, [path for path, _ in changed]))
+
+    to_parse = []
+    for (path, stat), sha256 in zip(changed, hashes):
+        if sha256 == None:
+            continue
+        entry = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "sha256": sha256,
+            "collection_name": sha256[:63],
+        }
+        try:
+            if collection_exists(entry["collection_name"]):
+                scanned[str(path)] = entry
+                register_scanned_doc(user, path, entry["collection_name"])
+            else:
+                to_parse.append((path, entry))
         except Exception as e:
             print(e)
 
+    # New content: parse across processes, embed and write here as results come in.
+    # spawn, since forking a process that holds the embedding model and threads is unsafe
+    if to_parse:
+        with ProcessPoolExecutor(
+            RAG_SCAN_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = {
+                executor.submit(
+                    load_and_split,
+                    path.name,
+                    mimetypes.guess_type(path)[0],
+                    str(path),
+                    app.state.CHUNK_SIZE,
+                    app.state.CHUNK_OVERLAP,
+                ): (path, entry)
+                for path, entry in to_parse
+            }
+            for future in as_completed(futures):
+                path, entry = futures[future]
+                try:
+                    texts, metadatas = future.result()
+                    ef = app.state.sentence_transformer_ef
+                    write_to_vector_db(
+                        entry["collection_name"],
+                        texts,
+                        metadatas,
+                        embed_texts(texts, ef=ef),
+                        ef.embedding_id,
+                    )
+                    scanned[str(path)] = entry
+                    register_scanned_doc(user, path, entry["collection_name"])
+                except Exception as e:
+                    print(e)
+
+    # Files removed from DOCS_DIR drop out of the manifest
+    save_scan_manifest(scanned)
     return True
 
 
 @app.get("/reset/db")
 def reset_vector_db(user=Depends(get_admin_user)):
     CHROMA_CLIENT.reset()
+    app.state.collection_cache.invalidate()
+    app.state.collection_aliases.clear()
+    reset_scan_manifest()
 
 
 @app.get("/reset")
@@ -581,6 +1175,9 @@ def reset(user=Depends(get_admin_user)) -> bool:
 
     try:
         CHROMA_CLIENT.reset()
+        app.state.collection_cache.invalidate()
+        app.state.collection_aliases.clear()
+        reset_scan_manifest()
     except Exception as e:
         print(e)
 
@@ -0,0 +1,152 @@
+from fastapi import Depends, HTTPException, status
+from typing import Optional
+
+from fastapi import APIRouter
+from pydantic import BaseModel
+
+from itertools import islice
+
+from sharkfin.util import redisutil
+from sharkfin.util.precompute import get_tracked_tickers, untrack_ticker
+from sharkfin.util.stockdata import CACHE_FAMILY, invalidate_cache_async
+
+from utils.utils import get_admin_user
+from constants import ERROR_MESSAGES
+
+router = APIRouter()
+
+
+class CacheInvalidateForm(BaseModel):
+    ticker: str
+    family: Optional[str] = None
+
+
+class CacheTickerForm(BaseModel):
+    ticker: str
+
+
+class CacheDeleteForm(BaseModel):
+    pattern: str
+    dry_run: Optional[bool] = False
+    # generation counters are kept by default, deleting them revives stale entries
+    include_generations: Optional[bool] = False
+
+
+############################
+# GetCacheFamilies
+############################
+
+
+@router.get("/families")
+async def get_cache_families(user=Depends(get_admin_user)):
+    return {"families": CACHE_FAMILY.as_list()}
+
+
+############################
+# InvalidateCache
+############################
+
+
+@router.post("/invalidate")
+async def invalidate_ticker_cache(
+    form_data: CacheInvalidateForm, user=Depends(get_admin_user)
+):
+    if form_data.family and form_data.family not in CACHE_FAMILY.as_list():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ERROR_MESSAGES.INCORRECT_FORMAT(
+                f": family must be one of {CACHE_FAMILY.as_list()}"
+            ),
+        )
+
+    try:
+        generation = await invalidate_cache_async(form_data.ticker, form_data.family)
+        return {
+            "status": True,
+            "ticker": form_data.ticker.upper(),
+            "family": form_data.family,
+            "generation": generation,
+        }
+    except Exception as e:
+        print(e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=ERROR_MESSAGES.DEFAULT(e),
+        )
+
+
+############################
+# ListCacheKeys
+############################
+
+# The admin routes below are sync so FastAPI runs them in its threadpool,
+# every Redis call they make is a bounded SCAN/pipeline batch.
+
+
+@router.get("/keys")
+def list_cache_keys(pattern: str = "*", limit: int = 100, user=Depends(get_admin_user)):
+    client = redisutil.get_client()
+    keys = islice(redisutil.scan_keys(client, pattern), limit)
+    return {
+        "keys": [key.decode("utf-8", errors="replace") for key in keys],
+    }
+
+
+############################
+# DeleteCacheKeys
+############################
+
+
+@router.post("/delete")
+def delete_cache_keys(form_data: CacheDeleteForm, user=Depends(get_admin_user)):
+    if form_data.pattern.strip() == "":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ERROR_MESSAGES.INCORRECT_FORMAT(": pattern is required"),
+        )
+
+    deleted = redisutil.delete_pattern(
+        redisutil.get_client(),
+        form_data.pattern,
+        dry_run=form_data.dry_run,
+        include_generations=form_data.include_generations,
+    )
+    return {
+        "status": True,
+        "pattern": form_data.pattern,
+        "dry_run": form_data.dry_run,
+        "include_generations": form_data.include_generations,
+        "deleted": deleted,
+    }
+
+
+############################
+# TrackedTickers
+############################
+
+
+@router.get("/tracked")
+def get_cache_tracked_tickers(user=Depends(get_admin_user)):
+    return {"tickers": get_tracked_tickers()}
+
+
+@router.post("/untrack")
+def untrack_cache_ticker(form_data: CacheTickerForm, user=Depends(get_admin_user)):
+    return {
+        "status": untrack_ticker(form_data.ticker),
+        "ticker": form_data.ticker.upper(),
+    }
+
+
+############################
+# GetCacheStats
+############################
+
+
+@router.get("/stats")
+def get_cache_stats(pattern: str = "*", user=Depends(get_admin_user)):
+    client = redisutil.get_client()
+    return {
+        "families": redisutil.family_stats(client, pattern),
+        "keyspace": redisutil.hit_ratio(client),
+    }
@@ -297,6 +297,13 @@ WEBUI_SECRET_KEY = os.environ.get(
 if WEBUI_AUTH and WEBUI_SECRET_KEY == "":
     raise ValueError(ERROR_MESSAGES.ENV_VAR_NOT_FOUND)
 
+####################################
+# METRICS_TOKEN
+####################################
+
+# Static bearer token for Prometheus scrapers, admins can always read /metrics
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
 ####################################
 # RAG
 ####################################
@@ -308,6 +315,27 @@ RAG_EMBEDDING_MODEL = os.environ.get("RAG_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
 RAG_EMBEDDING_MODEL_DEVICE_TYPE = os.environ.get(
     "RAG_EMBEDDING_MODEL_DEVICE_TYPE", "cpu"
 )
+# chunks encoded per forward pass during ingestion
+RAG_EMBEDDING_BATCH_SIZE = int(os.environ.get("RAG_EMBEDDING_BATCH_SIZE", "32"))
+# > 1 spreads large documents over that many encoding processes on RAG_EMBEDDING_MODEL_DEVICE_TYPE
+RAG_EMBEDDING_PROCESSES = int(os.environ.get("RAG_EMBEDDING_PROCESSES", "0"))
+# "torch" (default) or "onnx_int8": the same model on ONNX Runtime with int8 weights, for CPU-only deployments
+RAG_EMBEDDING_BACKEND = os.environ.get("RAG_EMBEDDING_BACKEND", "torch")
+RAG_EMBEDDING_ONNX_DIR = f"{CACHE_DIR}/rag/onnx"
+# instruction set the int8 kernels target: "avx2", "avx512", "avx512_vnni" or "arm64"
+RAG_EMBEDDING_ONNX_QUANTIZATION = os.environ.get(
+    "RAG_EMBEDDING_ONNX_QUANTIZATION", "avx2"
+)
+# ONNX Runtime intra-op threads, 0 uses every core
+RAG_EMBEDDING_ONNX_THREADS = int(os.environ.get("RAG_EMBEDDING_ONNX_THREADS", "0"))
+# Chunk embeddings keyed by (model, sha256 of the text), skips re-embedding duplicate chunks
+RAG_EMBEDDING_CACHE_ENABLED = (
+    os.environ.get("RAG_EMBEDDING_CACHE_ENABLED", "True").lower() == "true"
+)
+RAG_EMBEDDING_CACHE_DIR = f"{CACHE_DIR}/rag/embeddings"
+RAG_EMBEDDING_CACHE_MAX_ROWS = int(
+    os.environ.get("RAG_EMBEDDING_CACHE_MAX_ROWS", "1000000")
+)
 CHROMA_CLIENT = chromadb.PersistentClient(
     path=CHROMA_DATA_PATH,
     settings=Settings(allow_reset=True, anonymized_telemetry=False),
@@ -315,6 +343,24 @@ CHROMA_CLIENT = chromadb.PersistentClient(
 CHUNK_SIZE = 1500
 CHUNK_OVERLAP = 100
 
+# Document ingestion runs in a background job queue, with a worker pool per stage.
+# Embedding defaults to one worker as the model already uses all cores (or the GPU)
+RAG_INGEST_PARSE_WORKERS = int(os.environ.get("RAG_INGEST_PARSE_WORKERS", "2"))
+RAG_INGEST_EMBED_WORKERS = int(os.environ.get("RAG_INGEST_EMBED_WORKERS", "1"))
+RAG_INGEST_WRITE_WORKERS = int(os.environ.get("RAG_INGEST_WRITE_WORKERS", "1"))
+# Processes parsing new or changed files during a /scan of DOCS_DIR
+RAG_SCAN_WORKERS = int(os.environ.get("RAG_SCAN_WORKERS", str(os.cpu_count() or 1)))
+# Collections searched concurrently by a multi-document query
+RAG_QUERY_WORKERS = int(os.environ.get("RAG_QUERY_WORKERS", "8"))
+# Query embeddings kept in memory, repeated queries skip the embedding model
+RAG_QUERY_EMBEDDING_CACHE_SIZE = int(
+    os.environ.get("RAG_QUERY_EMBEDDING_CACHE_SIZE", "1024")
+)
+# Chroma collection handles kept open for queries
+RAG_COLLECTION_CACHE_SIZE = int(os.environ.get("RAG_COLLECTION_CACHE_SIZE", "256"))
+# Chunks re-embedded per page when an embedding model update re-indexes the collections
+RAG_REINDEX_BATCH_SIZE = int(os.environ.get("RAG_REINDEX_BATCH_SIZE", "256"))
+
 
 RAG_TEMPLATE = """Use the following context as your learned knowledge, inside <context></context> XML tags.
 <context>
@@ -9,10 +9,11 @@ import requests
 from fastapi import FastAPI, Request, Depends, status
 from fastapi.staticfiles import StaticFiles
 from fastapi import HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.wsgi import WSGIMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.exceptions import HTTPException as StarletteHTTPException
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 
 from litellm.proxy.proxy_server import ProxyConfig, initialize
@@ -26,10 +27,17 @@ from apps.rag.main import app as rag_app
 from apps.web.main import app as webui_app
 
 
+from sharkfin.util.cache import AsyncRedisCache
+from sharkfin.util.embeddings import set_local_embedder
+from sharkfin.util.precompute import (
+    start_precompute_scheduler,
+    stop_precompute_scheduler,
+)
+
 from config import WEBUI_NAME, ENV, VERSION, CHANGELOG, FRONTEND_BUILD_DIR
 from constants import ERROR_MESSAGES
 
-from utils.utils import get_http_authorization_cred, get_current_user
+from utils.utils import get_http_authorization_cred, get_current_user, get_metrics_user
 
 
 class SPAStaticFiles(StaticFiles):
@@ -56,6 +64,9 @@ async def config():
 
 async def startup():
     await config()
+    # The transcript index embeds with the RAG app's model instead of loading its own
+    set_local_embedder(lambda: rag_app.state.sentence_transformer_ef)
+    start_precompute_scheduler()
 
 
 app = FastAPI(docs_url="/docs" if ENV == "dev" else None, redoc_url=None)
@@ -76,6 +87,13 @@ async def on_startup():
     await startup()
 
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    stop_precompute_scheduler()
+    rag_app.state.ingestion_queue.shutdown()
+    await AsyncRedisCache().close()
+
+
 @app.middleware("http")
 async def check_url(request: Request, call_next):
     start_time = int(time.time())
@@ -147,6 +165,12 @@ async def get_app_latest_release_version():
         )
 
 
+@app.get("/metrics")
+async def get_metrics(user=Depends(get_metrics_user)):
+    # Prometheus scrape endpoint (cache hit/miss, bytes, latency and compression metrics)
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
@@ -1,6 +1,8 @@
 from langchain_community.utilities.google_serper import GoogleSerperAPIWrapper
 from langchain_core.tools import tool, Tool
 from sharkfin.util.stockdata import StockData
+from sharkfin.util.precompute import (
+    PRECOMPUTED_MODELS, PrecomputeScheduler, get_precomputed_many, precompute_models)
 from sharkfin.util.logger import Log
 import os
 from sharkfin.util.fmp import FMP
@@ -24,6 +26,7 @@ def get_agent_tools():
         analyst_earning_surprise,
         analyst_estimates,
         analyst_price_targets,
+        fundamental_models,
         # social_sentiment, # not that useful
     ]
 
@@ -252,6 +255,45 @@ def get_stock_intrinsic_value_dcf(
         """
 
 
+@tool
+def fundamental_models(symbol: str) -> str:
+    """
+    Get the precomputed fundamental models for a stock: Piotroski F-score, DCF estimates
+    (low/high scenarios and Monte Carlo percentile bands) and the average FCF growth rates.
+
+    Parameters:
+        symbol: The stock ticker
+
+    Returns:
+        str: The latest model results and when they were computed
+    """
+    precomputed = get_precomputed_many(symbol, PRECOMPUTED_MODELS.as_list())
+
+    if len(precomputed) == 0 and not PrecomputeScheduler().track(symbol):
+        # Precompute is disabled, nothing would ever fill the cache: compute on the request path
+        precomputed = precompute_models(symbol)
+
+    results = {
+        name: {'computed_at': computed_at.isoformat(), 'result': result}
+        for name, (result, computed_at) in precomputed.items()
+    }
+
+    if len(results) == 0:
+        # Queued for the background runner, never compute on the request path when it runs
+        return f"""
+            The fundamental models for {symbol} are not available yet, they are being computed in the background.
+            Tell the user to ask again in a few minutes, and answer with the other tools in the meantime.
+        """
+
+    return f"""
+        Precomputed fundamental models for {symbol}:
+        ---
+            {results}
+        ---
+        Mention when the models were computed (`computed_at`). Note: this is not financial advice.
+    """
+
+
 @tool
 def get_discounted_cashflow_fmp(symbol: str) -> str:
     """
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+import argparse
+import time
+
+import numpy as np
+
+from apps.rag.embeddings import exact_top_k
+from sharkfin.util.embeddings import EMBEDDING_BACKEND, get_embeddings
+from sharkfin.util.transcript import chunk_transcripts, get_batch_earnings_transcript_multiyear
+
+DEFAULT_QUERIES = [
+    'revenue growth guidance for next quarter',
+    'gross margin outlook',
+    'capital expenditure plans',
+    'share buyback and dividends',
+    'supply chain constraints',
+    'operating expenses and headcount',
+    'free cash flow',
+    'competition and pricing pressure',
+]
+
+
+def benchmark(symbol: str, years: list, queries: list, k: int) -> dict:
+    """
+    Embeds the same transcript chunks with every backend and reports indexing
+    throughput (chunks/sec) and recall@k of each backend against the OpenAI results.
+    """
+    chunks, _ = chunk_transcripts(get_batch_earnings_transcript_multiyear(symbol, years))
+    texts = [text for text, _ in chunks.values()]
+    if len(texts) == 0:
+        raise ValueError(f'no transcripts found for {symbol} {years}')
+
+    results = {}
+    top_k = {}
+    for backend in [EMBEDDING_BACKEND.OPENAI, EMBEDDING_BACKEND.LOCAL]:
+        embeddings = get_embeddings(backend)
+        start = time.perf_counter()
+        document_vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+        elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        query_vectors = np.asarray([embeddings.embed_query(query) for query in queries], dtype=np.float32)
+        query_latency = (time.perf_counter() - start) / len(queries)
+
+        top_k[backend] = exact_top_k(document_vectors, query_vectors, k)
+        results[backend] = {
+            'chunks': len(texts),
+            'chunks_per_sec': len(texts) / elapsed,
+            'query_latency_ms': query_latency * 1000,
+        }
+
+    reference = top_k[EMBEDDING_BACKEND.OPENAI]
+    for backend, backend_top_k in top_k.items():
+        overlaps = [len(set(expected) & set(actual)) / k
+                    for expected, actual in zip(reference, backend_top_k)]
+        results[backend][f'recall@{k}_vs_openai'] = float(np.mean(overlaps))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the OpenAI and local embedding backends on earnings transcripts')
+    parser.add_argument('symbol')
+    parser.add_argument('--years', nargs='+', type=int, required=True)
+    parser.add_argument('--queries', nargs='+', default=DEFAULT_QUERIES)
+    parser.add_argument('-k', type=int, default=4)
+    args = parser.parse_args()
+
+    results = benchmark(args.symbol.upper(), args.years, args.queries, args.k)
+    for backend, metrics in results.items():
+        print(backend)
+        for name, value in metrics.items():
+            print(f'  {name}: {value:.3f}' if isinstance(value, float) else f'  {name}: {value}')
+
+
+if __name__ == '__main__':
+    main()
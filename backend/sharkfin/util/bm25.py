@@ -0,0 +1,71 @@
+from collections import Counter, defaultdict
+import heapq
+import math
+import re
+
+# Keeps figures together, e.g. "3.5" and "1,200". Trailing punctuation and units are
+# dropped the same way everywhere, so "45.5%" in a transcript matches a query for 45.5
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+(?:[.,][0-9]+)*')
+
+RRF_K = 60
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Okapi BM25 over an inverted index: a query only touches the postings of its own terms.
+    Documents are referred to by their position in `documents`.
+    """
+
+    def __init__(self, documents: list, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.document_lengths = []
+        for position, document in enumerate(documents):
+            tokens = tokenize(document)
+            self.document_lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                self.postings[term].append((position, frequency))
+
+        self.average_length = (sum(self.document_lengths) / len(self.document_lengths)
+                               if self.document_lengths else 0)
+        total = len(self.document_lengths)
+        self.idf = {
+            term: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query: str, k: int, allowed: set | None = None) -> list:
+        """
+        Returns:
+            Up to k (position, score) pairs, best first. `allowed` restricts the candidate positions
+        """
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for position, frequency in self.postings[term]:
+                if allowed is not None and position not in allowed:
+                    continue
+                length_norm = 1 - self.b + self.b * self.document_lengths[position] / self.average_length
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = RRF_K) -> list:
+    """
+    Fuses several rankings (lists of ids, best first) into one.
+
+    Returns:
+        (id, score) pairs sorted by fused score, best first
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] += 1 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
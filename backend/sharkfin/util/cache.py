@@ -1,10 +1,75 @@
 import redis
+import redis.asyncio
 from pandas import DataFrame
 import pyarrow as pa
+import time
 
+from sharkfin.util.compression import compress, decompress
 from sharkfin.util.logger import Log
+from sharkfin.util.metrics import (
+    CACHE_BYTES,
+    CACHE_REDIS_SECONDS,
+    CACHE_REQUESTS,
+    CACHE_SERIALIZATION_SECONDS,
+)
 logger = Log().get_logger()
 
+REDIS_HOST = 'localhost'
+REDIS_PORT = 6379
+
+# Generation counters live under this family, e.g. gen:AAPL and gen:AAPL:statements
+GENERATION_FAMILY = 'gen'
+
+
+def generation_key(ticker: str, family: str | None = None) -> str:
+    key = f'{GENERATION_FAMILY}:{ticker.upper()}'
+    if family:
+        key += f':{family}'
+    return key
+
+
+def key_family(key) -> str:
+    """ Cache keys are `<family>:...`, see StockData._build_cache_key
+    """
+    if isinstance(key, bytes):
+        key = key.decode('utf-8', errors='replace')
+    return key.split(':', 1)[0] if ':' in key else 'other'
+
+
+def serialize_dataframe(value: DataFrame, cache_key='') -> bytes:
+    # serialize with pyarrow
+    start = time.perf_counter()
+    result = pa.serialize_pandas(value).to_pybytes()
+    CACHE_SERIALIZATION_SECONDS.labels(key_family(cache_key), 'serialize').observe(
+        time.perf_counter() - start)
+    return result
+
+
+def deserialize_dataframe(cached_data: bytes, cache_key='') -> DataFrame:
+    start = time.perf_counter()
+    result = pa.deserialize_pandas(cached_data)
+    CACHE_SERIALIZATION_SECONDS.labels(key_family(cache_key), 'deserialize').observe(
+        time.perf_counter() - start)
+    return result
+
+
+def _record_reads(command, start, keys, values):
+    CACHE_REDIS_SECONDS.labels(command).observe(time.perf_counter() - start)
+    for key, value in zip(keys, values):
+        family = key_family(key)
+        if value is None:
+            CACHE_REQUESTS.labels(family, 'miss').inc()
+        else:
+            CACHE_REQUESTS.labels(family, 'hit').inc()
+            CACHE_BYTES.labels(family, 'read').inc(len(value))
+
+
+def _record_writes(command, start, mapping: dict):
+    CACHE_REDIS_SECONDS.labels(command).observe(time.perf_counter() - start)
+    for key, value in mapping.items():
+        if isinstance(value, (bytes, str)):
+            CACHE_BYTES.labels(key_family(key), 'write').inc(len(value))
+
 
 class RedisCache:
     _instance = None
@@ -14,7 +79,7 @@ class RedisCache:
             try:
                 cls._instance = super().__new__(cls)
                 cls._instance.pool = redis.ConnectionPool(
-                    host='localhost', port=6379)
+                    host=REDIS_HOST, port=REDIS_PORT)
                 cls._instance.redis = redis.Redis(
                     connection_pool=cls._instance.pool)
             except Exception as e:
@@ -24,31 +89,202 @@ class RedisCache:
         return cls._instance
 
     def set(self, key, value, ex):
+        value = compress(value)
+        start = time.perf_counter()
         self.redis.set(key, value, ex)
+        _record_writes('set', start, {key: value})
 
     def get(self, key):
         if self.redis == {}:
             return None
 
-        return self.redis.get(key)
+        start = time.perf_counter()
+        value = self.redis.get(key)
+        _record_reads('get', start, [key], [value])
+        return decompress(value)
+
+    def get_many(self, keys: list) -> list:
+        """ Single round trip (MGET) for several keys, None for every miss
+        """
+        if self.redis == {} or len(keys) == 0:
+            return [None for _ in keys]
+
+        start = time.perf_counter()
+        values = self.redis.mget(keys)
+        _record_reads('mget', start, keys, values)
+        return [decompress(value) for value in values]
+
+    def set_many(self, mapping: dict, ex: int | dict | None = None):
+        """ Writes all the values in one pipelined round trip.
+        `ex` is either one TTL for all keys or a dict of key -> TTL
+        """
+        mapping = {key: compress(value) for key, value in mapping.items()}
+        start = time.perf_counter()
+        pipeline = self.redis.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipeline.set(key, value, ex=ex.get(key) if isinstance(ex, dict) else ex)
+        pipeline.execute()
+        _record_writes('pipeline_set', start, mapping)
+
+    def delete(self, *keys) -> int:
+        return self.redis.delete(*keys)
+
+    def add_members(self, key, *members):
+        self.redis.sadd(key, *members)
+
+    def remove_members(self, key, *members) -> int:
+        return self.redis.srem(key, *members)
+
+    def get_members(self, key) -> set:
+        if self.redis == {}:
+            return set()
+
+        return {member.decode('utf-8') for member in self.redis.smembers(key)}
+
+    def get_generations(self, namespaces: list) -> list:
+        """ Returns the generation counter of each namespace in a single MGET (0 if never bumped)
+        """
+        if self.redis == {}:
+            return [0 for _ in namespaces]
+
+        # Only the RTT is recorded: a never bumped counter is not a cache miss
+        start = time.perf_counter()
+        values = self.redis.mget(namespaces)
+        CACHE_REDIS_SECONDS.labels('mget_generations').observe(time.perf_counter() - start)
+        return [int(value) if value is not None else 0 for value in values]
+
+    def bump_generation(self, namespace) -> int:
+        """ Invalidates every key built on top of the namespace. Old entries are
+        never read again and simply age out through their TTL.
+        """
+        generation = self.redis.incr(namespace)
+        logger.info(f'bump_generation: {namespace}={generation}')
+        return generation
 
     def set_dataframe(self, cache_key, value: DataFrame, ex):
-        # serialize with pyarrow
-        result = pa.serialize_pandas(value).to_pybytes()
-        logger.debug(
-            f'set_dataframe key={cache_key}:len={len(result)},type={type(result)}'
-        )
+        result = serialize_dataframe(value, cache_key)
+        logger.debug(f'set_dataframe key={cache_key}:len={len(result)}')
         self.set(cache_key, result, ex=ex)
 
+    def set_dataframes(self, mapping: dict, ex: int | dict | None = None):
+        self.set_many(
+            {cache_key: serialize_dataframe(value, cache_key)
+             for cache_key, value in mapping.items()},
+            ex=ex)
+
+    def get_dataframes(self, cache_keys: list) -> list:
+        """ Batched get_dataframe, None for every miss
+        """
+        return [deserialize_dataframe(cached_data, cache_key) if cached_data else None
+                for cache_key, cached_data in zip(cache_keys, self.get_many(cache_keys))]
+
     def get_dataframe(self, cache_key):
         """ Function used specifically to load DataFrame objects from cache
         """
-        logger.debug(f'get_dataframe: {cache_key}')
         cached_data = self.get(cache_key)
         if cached_data:
-            logger.debug(
-                f'get_dataframe: cached hit for {cache_key}:len={len(cached_data)},type={type(cached_data)}')
-            result = pa.deserialize_pandas(cached_data)
-            logger.debug(f'data from cache: {result}')
+            result = deserialize_dataframe(cached_data, cache_key)
+            logger.debug(f'get_dataframe: cache hit for {cache_key}:len={len(cached_data)},shape={result.shape}')
             return result
         return None
+
+
+class AsyncRedisCache:
+    """
+    Same API as RedisCache on top of redis.asyncio, for `async def` handlers.
+    All callers share one connection pool, so awaiting cache I/O never blocks the event loop.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            try:
+                cls._instance = super().__new__(cls)
+                cls._instance.pool = redis.asyncio.ConnectionPool(
+                    host=REDIS_HOST, port=REDIS_PORT)
+                cls._instance.redis = redis.asyncio.Redis(
+                    connection_pool=cls._instance.pool)
+            except Exception as e:
+                # Don't use Redis if it's not set up
+                logger.warn(f'Error starting async Redis:\n{e}')
+                cls._instance = {}
+        return cls._instance
+
+    async def set(self, key, value, ex):
+        value = compress(value)
+        start = time.perf_counter()
+        await self.redis.set(key, value, ex)
+        _record_writes('set', start, {key: value})
+
+    async def get(self, key):
+        if self.redis == {}:
+            return None
+
+        start = time.perf_counter()
+        value = await self.redis.get(key)
+        _record_reads('get', start, [key], [value])
+        return decompress(value)
+
+    async def get_many(self, keys: list) -> list:
+        if self.redis == {} or len(keys) == 0:
+            return [None for _ in keys]
+
+        start = time.perf_counter()
+        values = await self.redis.mget(keys)
+        _record_reads('mget', start, keys, values)
+        return [decompress(value) for value in values]
+
+    async def set_many(self, mapping: dict, ex: int | dict | None = None):
+        mapping = {key: compress(value) for key, value in mapping.items()}
+        start = time.perf_counter()
+        async with self.redis.pipeline(transaction=False) as pipeline:
+            for key, value in mapping.items():
+                pipeline.set(key, value, ex=ex.get(key) if isinstance(ex, dict) else ex)
+            await pipeline.execute()
+        _record_writes('pipeline_set', start, mapping)
+
+    async def add_members(self, key, *members):
+        await self.redis.sadd(key, *members)
+
+    async def get_members(self, key) -> set:
+        if self.redis == {}:
+            return set()
+
+        return {member.decode('utf-8') for member in await self.redis.smembers(key)}
+
+    async def get_generations(self, namespaces: list) -> list:
+        if self.redis == {}:
+            return [0 for _ in namespaces]
+
+        start = time.perf_counter()
+        values = await self.redis.mget(namespaces)
+        CACHE_REDIS_SECONDS.labels('mget_generations').observe(time.perf_counter() - start)
+        return [int(value) if value is not None else 0 for value in values]
+
+    async def bump_generation(self, namespace) -> int:
+        generation = await self.redis.incr(namespace)
+        logger.info(f'bump_generation: {namespace}={generation}')
+        return generation
+
+    async def set_dataframe(self, cache_key, value: DataFrame, ex):
+        await self.set(cache_key, serialize_dataframe(value, cache_key), ex=ex)
+
+    async def set_dataframes(self, mapping: dict, ex: int | dict | None = None):
+        await self.set_many(
+            {cache_key: serialize_dataframe(value, cache_key)
+             for cache_key, value in mapping.items()},
+            ex=ex)
+
+    async def get_dataframe(self, cache_key):
+        cached_data = await self.get(cache_key)
+        if cached_data:
+            return deserialize_dataframe(cached_data, cache_key)
+        return None
+
+    async def get_dataframes(self, cache_keys: list) -> list:
+        return [deserialize_dataframe(cached_data, cache_key) if cached_data else None
+                for cache_key, cached_data in zip(cache_keys, await self.get_many(cache_keys))]
+
+    async def close(self):
+        if self.redis != {}:
+            await self.redis.aclose()
@@ -0,0 +1,111 @@
+import os
+import time
+
+from sharkfin.util.logger import Log
+from sharkfin.util.metrics import (
+    CACHE_COMPRESSION_BYTES,
+    CACHE_COMPRESSION_RATIO,
+    CACHE_COMPRESSION_SECONDS,
+)
+
+logger = Log().get_logger()
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Values smaller than this are stored as is, compressing them is not worth the CPU
+COMPRESSION_THRESHOLD = int(
+    os.environ.get('SHARKFIN_CACHE_COMPRESSION_THRESHOLD', 4096))
+COMPRESSION_LEVEL = int(os.environ.get('SHARKFIN_CACHE_COMPRESSION_LEVEL', 3))
+
+# Compressed values are stored as MAGIC + codec id + payload. Plain values never start
+# with MAGIC (pyarrow buffers start with 0xFF, everything else is text), so both coexist.
+MAGIC = b'\x00SFZ'
+HEADER_SIZE = len(MAGIC) + 1
+
+
+class CODEC:
+    ZSTD = 1
+    LZ4 = 2
+
+    NAMES = {ZSTD: 'zstd', LZ4: 'lz4'}
+
+
+def _available_codec() -> int | None:
+    preferred = os.environ.get('SHARKFIN_CACHE_COMPRESSION', 'zstd').lower()
+    if preferred == 'none':
+        return None
+    if preferred == 'zstd' and zstandard is not None:
+        return CODEC.ZSTD
+    if lz4 is not None:
+        return CODEC.LZ4
+    if zstandard is not None:
+        return CODEC.ZSTD
+    logger.warning('Neither zstandard nor lz4 is installed, cache values are stored uncompressed')
+    return None
+
+
+DEFAULT_CODEC = _available_codec()
+
+
+def _compress(codec: int, data: bytes) -> bytes:
+    if codec == CODEC.ZSTD:
+        return zstandard.ZstdCompressor(level=COMPRESSION_LEVEL).compress(data)
+    return lz4.frame.compress(data)
+
+
+def _decompress(codec: int, data: bytes) -> bytes:
+    if codec == CODEC.ZSTD:
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == CODEC.LZ4:
+        return lz4.frame.decompress(data)
+    raise ValueError(f'unknown cache compression codec {codec}')
+
+
+def compress(value):
+    """
+    Compresses bytes and str values above COMPRESSION_THRESHOLD with a self-describing
+    header. Anything else, or values that would not shrink, is returned unchanged.
+    """
+    if DEFAULT_CODEC is None:
+        return value
+    if isinstance(value, str):
+        if len(value) < COMPRESSION_THRESHOLD:
+            return value
+        value = value.encode('utf-8')
+    if not isinstance(value, (bytes, bytearray)) or len(value) < COMPRESSION_THRESHOLD:
+        return value
+
+    codec_name = CODEC.NAMES[DEFAULT_CODEC]
+    start = time.perf_counter()
+    compressed = MAGIC + bytes([DEFAULT_CODEC]) + _compress(DEFAULT_CODEC, value)
+    CACHE_COMPRESSION_SECONDS.labels(codec_name, 'compress').observe(
+        time.perf_counter() - start)
+    if len(compressed) >= len(value):
+        return value
+
+    CACHE_COMPRESSION_RATIO.labels(codec_name).observe(len(value) / len(compressed))
+    CACHE_COMPRESSION_BYTES.labels(codec_name, 'raw').inc(len(value))
+    CACHE_COMPRESSION_BYTES.labels(codec_name, 'stored').inc(len(compressed))
+    return compressed
+
+
+def decompress(value):
+    """ Inverse of `compress`, plain values are returned unchanged
+    """
+    if not isinstance(value, (bytes, bytearray)) or not value.startswith(MAGIC):
+        return value
+
+    codec = value[len(MAGIC)]
+    start = time.perf_counter()
+    result = _decompress(codec, value[HEADER_SIZE:])
+    CACHE_COMPRESSION_SECONDS.labels(CODEC.NAMES.get(codec, str(codec)), 'decompress').observe(
+        time.perf_counter() - start)
+    return result
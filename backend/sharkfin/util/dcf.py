@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+
+DEFAULT_PERCENTILES = [5, 25, 50, 75, 95]
+
+
+def intrinsic_values(
+        free_cash_flow: float,
+        cash: float,
+        total_debt: float,
+        shares_outstanding: float,
+        growth_rate,
+        perpetual_growth_rate,
+        wacc,
+        periods,
+) -> np.ndarray:
+    """
+    Vectorized two-stage DCF. The scenario parameters are broadcast against each
+    other, so scalars, grids and Monte Carlo draws are all evaluated in one pass.
+
+    Stage 1 grows `free_cash_flow` by `growth_rate` for `periods` years, stage 2
+    is a Gordon growth terminal value. Both are discounted at `wacc`, then cash is
+    added, debt removed and the equity value is divided by `shares_outstanding`.
+
+    Returns:
+        The intrinsic value per share, shaped like the broadcast parameters.
+        Scenarios where wacc <= perpetual_growth_rate have no value and are NaN.
+    """
+    growth_rate, perpetual_growth_rate, wacc, periods = np.broadcast_arrays(
+        *(np.asarray(param, dtype=float)
+          for param in (growth_rate, perpetual_growth_rate, wacc, periods)))
+
+    # Time axis goes last, entries past each scenario's period count are masked out
+    years = np.arange(1, int(periods.max()) + 1)
+    growth = (1 + growth_rate)[..., None]
+    discount = (1 + wacc)[..., None]
+    projected = free_cash_flow * (growth / discount) ** years
+    present_cash_flows = np.where(
+        years <= periods[..., None], projected, 0.0).sum(axis=-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terminal_value = (free_cash_flow * (1 + growth_rate) ** periods
+                          * (1 + perpetual_growth_rate) / (wacc - perpetual_growth_rate))
+        present_terminal_value = terminal_value / (1 + wacc) ** periods
+        equity_value = present_cash_flows + present_terminal_value + cash - total_debt
+        result = equity_value / shares_outstanding
+
+    return np.where(wacc > perpetual_growth_rate, result, np.nan)
+
+
+def sensitivity_grid(
+        inputs: dict,
+        growth_rates,
+        perpetual_growth_rates,
+        waccs,
+        periods,
+) -> pd.DataFrame:
+    """
+    Evaluates every combination of the given parameter values.
+
+    Parameters:
+        inputs: free_cash_flow, cash, total_debt and shares_outstanding, see `intrinsic_values`
+
+    Returns:
+        One row per scenario with its parameters and intrinsic value
+    """
+    mesh = np.meshgrid(growth_rates, perpetual_growth_rates, waccs, periods, indexing='ij')
+    growth_rate, perpetual_growth_rate, wacc, period = (axis.ravel() for axis in mesh)
+    values = intrinsic_values(
+        **inputs,
+        growth_rate=growth_rate,
+        perpetual_growth_rate=perpetual_growth_rate,
+        wacc=wacc,
+        periods=period,
+    )
+    return pd.DataFrame({
+        'growth rate': growth_rate,
+        'perpetual growth rate': perpetual_growth_rate,
+        'wacc': wacc,
+        'periods': period.astype(int),
+        'intrinsic value': values,
+    })
+
+
+def monte_carlo(
+        inputs: dict,
+        growth_rate: tuple,
+        perpetual_growth_rate: tuple,
+        wacc: tuple,
+        periods: int = 10,
+        draws: int = 10000,
+        seed: int | None = None,
+) -> np.ndarray:
+    """
+    Draws normally distributed scenarios and values all of them at once.
+
+    Parameters:
+        growth_rate, perpetual_growth_rate, wacc: (mean, standard deviation) of each parameter
+
+    Returns:
+        The intrinsic value of each draw (NaN when the draw has wacc <= perpetual growth)
+    """
+    rng = np.random.default_rng(seed)
+    return intrinsic_values(
+        **inputs,
+        growth_rate=rng.normal(*growth_rate, size=draws),
+        perpetual_growth_rate=rng.normal(*perpetual_growth_rate, size=draws),
+        wacc=rng.normal(*wacc, size=draws),
+        periods=periods,
+    )
+
+
+def percentile_bands(values, current_price: float, percentiles=DEFAULT_PERCENTILES) -> pd.DataFrame:
+    """ Summarizes a set of intrinsic values relative to the current price, ignoring invalid scenarios
+    """
+    bands = np.nanpercentile(values, percentiles)
+    return pd.DataFrame({
+        'percentile': percentiles,
+        'intrinsic value': bands,
+        'percent of current price': bands / current_price,
+    })
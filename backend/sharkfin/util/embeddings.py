@@ -0,0 +1,103 @@
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+from functools import lru_cache
+from typing import Callable
+import numpy as np
+import os
+import re
+
+from sharkfin.util.logger import Log
+
+logger = Log().get_logger()
+
+
+class EMBEDDING_BACKEND:
+    OPENAI = 'openai'
+    LOCAL = 'local'
+
+
+# `local` runs sentence-transformers in process: no API round trip, works offline.
+# It shares the RAG app's embedder, so RAG_EMBEDDING_MODEL and RAG_EMBEDDING_BACKEND apply.
+TRANSCRIPT_EMBEDDING_BACKEND = os.environ.get(
+    'SHARKFIN_EMBEDDING_BACKEND', EMBEDDING_BACKEND.OPENAI).lower()
+
+# Returns the embedder currently used by the RAG app, see `set_local_embedder`
+_local_embedder_provider: Callable | None = None
+
+
+def set_local_embedder(provider: Callable):
+    """
+    Shares the RAG app's embedder (model, torch/onnx_int8 backend and process pool)
+    instead of loading a second copy of the model. `provider` is called on every use,
+    so an embedding model update in the RAG app is followed.
+    """
+    global _local_embedder_provider
+    _local_embedder_provider = provider
+
+
+@lru_cache(maxsize=None)
+def _load_local_embedder():
+    # Outside of the web app (scripts, benchmarks), built with the RAG app's settings.
+    # Imported lazily, the OpenAI backend does not need torch
+    from apps.rag.embeddings import SentenceTransformerEmbedder
+    from config import (
+        RAG_EMBEDDING_MODEL,
+        RAG_EMBEDDING_MODEL_DEVICE_TYPE,
+        RAG_EMBEDDING_BATCH_SIZE,
+        RAG_EMBEDDING_BACKEND,
+        RAG_EMBEDDING_ONNX_DIR,
+        RAG_EMBEDDING_ONNX_QUANTIZATION,
+        RAG_EMBEDDING_ONNX_THREADS,
+    )
+
+    logger.info(f'Loading sentence-transformers model {RAG_EMBEDDING_MODEL} ({RAG_EMBEDDING_BACKEND})')
+    return SentenceTransformerEmbedder(
+        model_name=RAG_EMBEDDING_MODEL,
+        device=RAG_EMBEDDING_MODEL_DEVICE_TYPE,
+        batch_size=RAG_EMBEDDING_BATCH_SIZE,
+        backend=RAG_EMBEDDING_BACKEND,
+        onnx_dir=RAG_EMBEDDING_ONNX_DIR,
+        onnx_quantization=RAG_EMBEDDING_ONNX_QUANTIZATION,
+        onnx_threads=RAG_EMBEDDING_ONNX_THREADS,
+    )
+
+
+def get_local_embedder():
+    if _local_embedder_provider is not None:
+        return _local_embedder_provider()
+    return _load_local_embedder()
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    LangChain embeddings on top of the RAG app's sentence-transformers embedder.
+    """
+
+    def embed_documents(self, texts: list) -> list:
+        vectors = get_local_embedder().encode(texts)
+        # Unit length, so Chroma's L2 distance ranks like cosine similarity
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return (vectors / np.maximum(norms, 1e-12)).tolist()
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+
+@lru_cache(maxsize=None)
+def get_embeddings(backend: str = TRANSCRIPT_EMBEDDING_BACKEND) -> Embeddings:
+    if backend == EMBEDDING_BACKEND.LOCAL:
+        return LocalEmbeddings()
+    if backend == EMBEDDING_BACKEND.OPENAI:
+        return OpenAIEmbeddings()
+    raise ValueError(f'unknown embedding backend {backend}')
+
+
+def embeddings_id(backend: str = TRANSCRIPT_EMBEDDING_BACKEND) -> str:
+    """
+    Short identifier of the embedding space. Vectors from different models cannot be
+    compared, so indexes are kept apart per backend/model.
+    """
+    if backend == EMBEDDING_BACKEND.OPENAI:
+        return EMBEDDING_BACKEND.OPENAI
+    embedding_id = get_local_embedder().embedding_id
+    return re.sub(r'[^a-zA-Z0-9]+', '-', embedding_id.split('/')[-1]).strip('-')[:32]
@@ -0,0 +1,44 @@
+from prometheus_client import Counter, Histogram
+
+# Shared Prometheus metrics for the sharkfin utilities (default registry)
+
+CACHE_COMPRESSION_RATIO = Histogram(
+    'sharkfin_cache_compression_ratio',
+    'Uncompressed / compressed size of the values RedisCache compressed',
+    ['codec'],
+    buckets=[1, 1.5, 2, 3, 4, 6, 8, 12, 16, 24, 32],
+)
+CACHE_COMPRESSION_SECONDS = Histogram(
+    'sharkfin_cache_compression_seconds',
+    'Time spent compressing or decompressing cached values',
+    ['codec', 'operation'],
+    buckets=[0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25],
+)
+CACHE_COMPRESSION_BYTES = Counter(
+    'sharkfin_cache_compression_bytes',
+    'Bytes before (raw) and after (stored) compression',
+    ['codec', 'kind'],
+)
+
+CACHE_REQUESTS = Counter(
+    'sharkfin_cache_requests',
+    'RedisCache lookups per key family',
+    ['family', 'result'],
+)
+CACHE_BYTES = Counter(
+    'sharkfin_cache_bytes',
+    'Bytes read from and written to Redis per key family (as stored, i.e. compressed)',
+    ['family', 'direction'],
+)
+CACHE_SERIALIZATION_SECONDS = Histogram(
+    'sharkfin_cache_serialization_seconds',
+    'Time spent (de)serializing DataFrames per key family',
+    ['family', 'operation'],
+    buckets=[0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5],
+)
+CACHE_REDIS_SECONDS = Histogram(
+    'sharkfin_cache_redis_seconds',
+    'Redis round trip time per command',
+    ['command'],
+    buckets=[0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1],
+)
@@ -0,0 +1,245 @@
+from apscheduler.schedulers.background import BackgroundScheduler
+from datetime import datetime, timezone
+from io import StringIO
+import json
+import os
+import pandas as pd
+
+from sharkfin.util.fmp import FMP
+from sharkfin.util.logger import Log
+from sharkfin.util.transcript_digest import refresh_latest_transcript_digest
+from sharkfin.util.stockdata import (
+    CACHE,
+    CACHE_FAMILY,
+    CACHE_TTL_1WEEK,
+    StockData,
+    StockUtil,
+    invalidate_cache,
+)
+
+logger = Log().get_logger()
+
+PRECOMPUTE_ENABLED = os.environ.get(
+    'SHARKFIN_PRECOMPUTE_ENABLED', 'True').lower() == 'true'
+# Comma separated tickers that are always tracked, on top of the ones the agent asked about
+TRACKED_TICKERS = [ticker.strip().upper() for ticker in os.environ.get(
+    'SHARKFIN_TRACKED_TICKERS', '').split(',') if ticker.strip()]
+FILING_CHECK_INTERVAL_HOURS = int(
+    os.environ.get('SHARKFIN_FILING_CHECK_INTERVAL_HOURS', 6))
+
+TRACKED_TICKERS_KEY = 'tracked:tickers'
+LATEST_FILING_KEY = 'tracked:latest_filing'
+
+
+class PRECOMPUTED_MODELS:
+    PIOTROSKI_SCORE = 'piotroski_score'
+    DCF_ESTIMATE = 'dcf_estimate'
+    DCF_MONTE_CARLO = 'dcf_monte_carlo'
+    CASHFLOW_GROWTH_RATE = 'cashflow_growth_rate'
+
+    @staticmethod
+    def compute(name, stock: StockData):
+        mapping = {
+            PRECOMPUTED_MODELS.PIOTROSKI_SCORE: stock.get_piotroski_score,
+            PRECOMPUTED_MODELS.DCF_ESTIMATE: stock.estimate_dcf,
+            PRECOMPUTED_MODELS.DCF_MONTE_CARLO: stock.dcf_monte_carlo,
+            PRECOMPUTED_MODELS.CASHFLOW_GROWTH_RATE: lambda: StockUtil.get_cashflow_growth_rate(
+                stock._ticker),
+        }
+        return mapping[name]()
+
+    @classmethod
+    def as_list(cls):
+        return [cls.PIOTROSKI_SCORE, cls.DCF_ESTIMATE, cls.DCF_MONTE_CARLO, cls.CASHFLOW_GROWTH_RATE]
+
+
+def _precomputed_cache_keys(stock: StockData, names) -> dict:
+    # Models family: a new filing (statements generation bump) orphans the result.
+    # Same keys as _build_cache_key(MODELS, 'precomputed', name), with a single generation lookup
+    key_prefix = stock._build_cache_key(CACHE_FAMILY.MODELS, 'precomputed')
+    return {name: f'{key_prefix}_{name}' for name in names}
+
+
+def _serialize_precomputed(result, computed_at: datetime) -> str:
+    is_dataframe = isinstance(result, pd.DataFrame)
+    return json.dumps({
+        'computed_at': computed_at.isoformat(),
+        'dataframe': is_dataframe,
+        'result': result.to_json(orient='split') if is_dataframe else result,
+    })
+
+
+def get_precomputed_many(ticker: str, names: list) -> dict:
+    """
+    Returns:
+        name -> (result, computed_at) of the latest background run, for the models that already ran
+    """
+    cache_keys = _precomputed_cache_keys(StockData(ticker), names)
+    results = {}
+    for name, cached_result in zip(names, CACHE.get_many([cache_keys[name] for name in names])):
+        if cached_result is None:
+            continue
+        payload = json.loads(cached_result)
+        result = payload['result']
+        if payload['dataframe']:
+            result = pd.read_json(StringIO(result), orient='split')
+        results[name] = (result, datetime.fromisoformat(payload['computed_at']))
+    return results
+
+
+def get_precomputed(ticker: str, name: str):
+    """
+    Returns:
+        (result, computed_at) of the latest background run, or None if it has not run yet
+    """
+    return get_precomputed_many(ticker, [name]).get(name)
+
+
+def precompute_models(ticker: str) -> dict:
+    """
+    Computes and caches every precomputed model of the ticker.
+
+    Returns:
+        name -> (result, computed_at), for the models that did not fail
+    """
+    ticker = ticker.upper()
+    stock = StockData(ticker)
+    names = PRECOMPUTED_MODELS.as_list()
+    # Computing the models reuses the generations read for these keys
+    cache_keys = _precomputed_cache_keys(stock, names)
+    results = {}
+    for name in names:
+        try:
+            results[name] = (PRECOMPUTED_MODELS.compute(name, stock), datetime.now(timezone.utc))
+        except Exception as e:
+            logger.error(f'precompute_models: {name} failed for {ticker}: {e}')
+    CACHE.set_many(
+        {cache_keys[name]: _serialize_precomputed(*results[name]) for name in results},
+        ex=CACHE_TTL_1WEEK)
+    return results
+
+
+def precompute_ticker(ticker: str, track: bool = False):
+    """
+    Parameters:
+        track: start tracking the ticker, only once at least one model computed. Unknown
+            or misspelled tickers then never end up in the daily and filing jobs
+    """
+    ticker = ticker.upper()
+    if not precompute_models(ticker):
+        logger.warning(f'precompute_ticker: no model computed for {ticker}')
+        return
+    if track:
+        CACHE.add_members(TRACKED_TICKERS_KEY, ticker)
+
+    try:
+        refresh_latest_transcript_digest(ticker)
+    except Exception as e:
+        logger.error(f'precompute_ticker: transcript digest failed for {ticker}: {e}')
+    logger.info(f'precompute_ticker: done for {ticker}')
+
+
+def get_tracked_tickers() -> list:
+    return sorted(set(TRACKED_TICKERS) | CACHE.get_members(TRACKED_TICKERS_KEY))
+
+
+def untrack_ticker(ticker: str) -> bool:
+    """ Stops the background jobs for a ticker the agent asked about. SHARKFIN_TRACKED_TICKERS
+    are always tracked.
+
+    Returns:
+        Whether the ticker was tracked
+    """
+    ticker = ticker.upper()
+    CACHE.delete(f'{LATEST_FILING_KEY}:{ticker}')
+    return CACHE.remove_members(TRACKED_TICKERS_KEY, ticker) > 0
+
+
+def precompute_tracked_tickers():
+    """ Daily close job: prices moved, so refresh every model that depends on them
+    """
+    for ticker in get_tracked_tickers():
+        invalidate_cache(ticker, CACHE_FAMILY.PRICES)
+        precompute_ticker(ticker)
+
+
+def check_new_filings():
+    """
+    Compares the latest reported earnings date of each tracked ticker with the one
+    seen last time. A new filing invalidates the ticker's statements and recomputes its models.
+    """
+    for ticker in get_tracked_tickers():
+        try:
+            earnings = FMP.get_earnings_surprise(ticker)
+            if not earnings:
+                continue
+            latest_filing = earnings[0]['date']
+            filing_key = f'{LATEST_FILING_KEY}:{ticker}'
+            previous_filing = CACHE.get(filing_key)
+            if previous_filing is not None and previous_filing.decode('utf-8') == latest_filing:
+                continue
+
+            logger.info(f'check_new_filings: new filing for {ticker} ({latest_filing})')
+            if previous_filing is not None:
+                invalidate_cache(ticker, CACHE_FAMILY.STATEMENTS)
+            precompute_ticker(ticker)
+            CACHE.set(filing_key, latest_filing, ex=None)
+        except Exception as e:
+            logger.error(f'check_new_filings: failed for {ticker}: {e}')
+
+
+class PrecomputeScheduler:
+    """
+    Runs the heavy StockData models for tracked tickers in the background, after
+    each daily close and whenever a new filing shows up. Agent tools read the
+    results through `get_precomputed` and never call FinanceToolkit themselves.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.scheduler = BackgroundScheduler(timezone='America/New_York')
+        return cls._instance
+
+    def start(self):
+        if self.scheduler.running:
+            return
+        # After the US market close on trading days
+        self.scheduler.add_job(
+            precompute_tracked_tickers, 'cron', day_of_week='mon-fri', hour=16, minute=30,
+            id='precompute_tracked_tickers', replace_existing=True)
+        self.scheduler.add_job(
+            check_new_filings, 'interval', hours=FILING_CHECK_INTERVAL_HOURS,
+            next_run_time=datetime.now(timezone.utc),
+            id='check_new_filings', replace_existing=True)
+        self.scheduler.start()
+        logger.info(f'PrecomputeScheduler started, tracking {get_tracked_tickers()}')
+
+    def shutdown(self):
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+
+    def track(self, ticker: str) -> bool:
+        """ Precomputes the ticker right away, without blocking the caller, and tracks it
+        if that succeeded
+
+        Returns:
+            False when the scheduler is not running and nothing was queued
+        """
+        ticker = ticker.upper()
+        if not self.scheduler.running:
+            return False
+        self.scheduler.add_job(
+            precompute_ticker, args=[ticker], kwargs={'track': True},
+            id=f'precompute_ticker:{ticker}', replace_existing=True)
+        return True
+
+
+def start_precompute_scheduler():
+    if PRECOMPUTE_ENABLED:
+        PrecomputeScheduler().start()
+
+
+def stop_precompute_scheduler():
+    PrecomputeScheduler().shutdown()
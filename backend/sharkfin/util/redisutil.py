@@ -1,44 +1,152 @@
+#!/usr/bin/env python
+import argparse
+import json
+from collections import defaultdict
+from itertools import islice
+
 import redis
-import datetime
 
-redis_client = redis.Redis(host="localhost", port=6379)
+from sharkfin.util.cache import GENERATION_FAMILY, RedisCache, key_family
+
+# Upper bounds of the histogram buckets, the last bucket is open ended
+SIZE_BUCKETS = [1024, 4 * 1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024]
+TTL_BUCKETS = [60 * 60, 24 * 60 * 60, 7 * 24 * 60 * 60, 30 * 24 * 60 * 60]
+
+SCAN_COUNT = 1000
+BATCH_SIZE = 500
+
+
+def get_client() -> redis.Redis:
+    return RedisCache().redis
+
+
+def scan_keys(client: redis.Redis, pattern: str = '*', count: int = SCAN_COUNT):
+    """ Iterates over the keys with SCAN, which never blocks Redis like KEYS does
+    """
+    yield from client.scan_iter(match=pattern, count=count)
+
+
+def _batches(iterable, size: int = BATCH_SIZE):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def delete_pattern(client: redis.Redis, pattern: str, dry_run: bool = False,
+                   include_generations: bool = False) -> int:
+    """
+    Deletes the matching keys in batched UNLINKs: memory is reclaimed in the
+    background, so large values do not stall Redis either.
+
+    Generation counters are skipped unless `include_generations` is set: deleting
+    one resets it to 0, which revives the orphaned entries still within their TTL.
+
+    Returns:
+        The number of keys deleted (or that would be deleted with dry_run)
+    """
+    keys = scan_keys(client, pattern)
+    if not include_generations:
+        keys = (key for key in keys if key_family(key) != GENERATION_FAMILY)
+
+    deleted = 0
+    for batch in _batches(keys):
+        deleted += len(batch) if dry_run else client.unlink(*batch)
+    return deleted
+
+
+def _bucket_label(value: int, buckets: list, unit: str) -> str:
+    for bound in buckets:
+        if value < bound:
+            return f'<{bound}{unit}'
+    return f'>={buckets[-1]}{unit}'
+
+
+def family_stats(client: redis.Redis, pattern: str = '*') -> dict:
+    """
+    Key count, total bytes and size/TTL histograms per key family. MEMORY USAGE
+    and TTL are pipelined per batch of scanned keys.
+    """
+    stats = defaultdict(lambda: {
+        'keys': 0,
+        'bytes': 0,
+        'size_histogram': defaultdict(int),
+        'ttl_histogram': defaultdict(int),
+    })
+    for batch in _batches(scan_keys(client, pattern)):
+        pipeline = client.pipeline(transaction=False)
+        for key in batch:
+            pipeline.memory_usage(key)
+            pipeline.ttl(key)
+        results = pipeline.execute()
+
+        for key, size, ttl in zip(batch, results[0::2], results[1::2]):
+            if size is None:
+                # expired or deleted since it was scanned
+                continue
+            family = stats[key_family(key)]
+            family['keys'] += 1
+            family['bytes'] += size
+            family['size_histogram'][_bucket_label(size, SIZE_BUCKETS, 'B')] += 1
+            ttl_label = 'no expiry' if ttl < 0 else _bucket_label(ttl, TTL_BUCKETS, 's')
+            family['ttl_histogram'][ttl_label] += 1
+
+    return {
+        family: {
+            **values,
+            'size_histogram': dict(values['size_histogram']),
+            'ttl_histogram': dict(values['ttl_histogram']),
+        }
+        for family, values in stats.items()
+    }
+
 
+def hit_ratio(client: redis.Redis) -> dict:
+    """ Server wide keyspace hits and misses since the last Redis restart / CONFIG RESETSTAT
+    """
+    info = client.info('stats')
+    hits = info.get('keyspace_hits', 0)
+    misses = info.get('keyspace_misses', 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / (hits + misses) if hits + misses else None,
+    }
 
-def delete_pattern():
-    # Scan for keys matching the pattern
-    cursor = "0"
-    pattern = "AAPL*"  # Example pattern
-    while cursor != 0:
-        cursor, keys = redis_client.scan(cursor=cursor, match=pattern, count=1000)
-        if keys:
-            print(f"deleting keys: {keys}")
-            redis_client.delete(*keys)
 
+def main():
+    parser = argparse.ArgumentParser(description='Inspect and trim the sharkfin Redis cache')
+    subparsers = parser.add_subparsers(dest='command', required=True)
 
-def scan():
-    # Use the SCAN command for retrieving keys iteratively
-    cursor = "0"  # Initial cursor
-    while cursor != 0:
-        cursor, keys = redis_client.scan(cursor=cursor, match="*", count=100)
-        for key in keys:
-            print(key.decode("utf-8"))
+    list_parser = subparsers.add_parser('list', help='list keys matching a pattern')
+    list_parser.add_argument('pattern', nargs='?', default='*')
+    list_parser.add_argument('--limit', type=int, default=100)
 
+    delete_parser = subparsers.add_parser('delete', help='delete keys matching a pattern')
+    delete_parser.add_argument('pattern')
+    delete_parser.add_argument('--dry-run', action='store_true')
+    delete_parser.add_argument('--include-generations', action='store_true',
+                               help=f'also delete the {GENERATION_FAMILY}: counters')
 
-def check_cache():
-    keys = redis_client.keys()  # Get all keys in the cache
-    for key in keys:
-        # Get the value associated with each key
-        print(f"Key: {key}")
+    stats_parser = subparsers.add_parser('stats', help='size and TTL histograms per key family')
+    stats_parser.add_argument('pattern', nargs='?', default='*')
 
+    subparsers.add_parser('hits', help='keyspace hit ratio')
 
-def basic_test():
-    # Set a value in the cache
-    redis_client.set("test_key", "test_value")
+    args = parser.parse_args()
+    client = get_client()
 
-    # Retrieve the value from the cache
-    cached_value = redis_client.get("test_key")
-    print("Cached value:", cached_value.decode("utf-8"))
+    if args.command == 'list':
+        for key in islice(scan_keys(client, args.pattern), args.limit):
+            print(key.decode('utf-8', errors='replace'))
+    elif args.command == 'delete':
+        deleted = delete_pattern(client, args.pattern, dry_run=args.dry_run,
+                                 include_generations=args.include_generations)
+        print(f"{'would delete' if args.dry_run else 'deleted'} {deleted} keys")
+    elif args.command == 'stats':
+        print(json.dumps(family_stats(client, args.pattern), indent=2))
+    elif args.command == 'hits':
+        print(json.dumps(hit_ratio(client), indent=2))
 
 
-basic_test()
-check_cache()
+if __name__ == '__main__':
+    main()
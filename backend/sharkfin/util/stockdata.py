@@ -1,24 +1,70 @@
 # https://github.com/JerBouma/FinanceToolkit
 from financetoolkit import Toolkit
-import os
+import numpy as np
 import pandas as pd
-from sharkfin.util.cache import RedisCache
+from sharkfin.util import dcf
+from sharkfin.util.cache import AsyncRedisCache, RedisCache, generation_key
 from sharkfin.util.logger import Log
+from sharkfin.util.toolkit import ToolkitRegistry, get_toolkit
 
 logger = Log().get_logger()
 
-# Load API Key from environment
-API_KEY = os.getenv('FMP_API_KEY')
 CACHE = RedisCache()
 CACHE_TTL_1H = 60 * 60
 CACHE_TTL_1DAY = 24 * CACHE_TTL_1H
 CACHE_TTL_1WEEK = 7 * CACHE_TTL_1DAY
 CACHE_TTL_1MONTH = 30 * CACHE_TTL_1DAY
 
-# Change this to invalidate all cache
+# Change this to invalidate all cache (e.g. when the serialization format changes).
+# To drop a single ticker or data family use `invalidate_cache` instead.
 CACHE_VERSION = '24.2.19.e'
 
 
+class CACHE_FAMILY:
+    """
+    Every cached value belongs to a family. Each ticker has a generation counter
+    for itself and one per family; bumping a counter orphans the matching keys.
+    """
+    PRICES = 'prices'
+    STATEMENTS = 'statements'
+    MODELS = 'models'
+
+    @classmethod
+    def as_list(cls):
+        return [cls.PRICES, cls.STATEMENTS, cls.MODELS]
+
+    @classmethod
+    def dependencies(cls, family) -> list:
+        # Models are derived from the statements, so a new filing must invalidate them too
+        if family == cls.MODELS:
+            return [cls.STATEMENTS]
+        return []
+
+
+def invalidate_cache(ticker: str, family: str | None = None) -> int:
+    """
+    Invalidates all cached data for a ticker, or only one family of it, in O(1)
+    by bumping its generation counter. Returns the new generation.
+    """
+    return CACHE.bump_generation(_invalidation_namespace(ticker, family))
+
+
+async def invalidate_cache_async(ticker: str, family: str | None = None) -> int:
+    """ Same as `invalidate_cache`, for async handlers
+    """
+    return await AsyncRedisCache().bump_generation(_invalidation_namespace(ticker, family))
+
+
+def _invalidation_namespace(ticker: str, family: str | None) -> str:
+    if family is not None and family not in CACHE_FAMILY.as_list():
+        raise ValueError(f'family must be one of {CACHE_FAMILY.as_list()}')
+    if family in [None, CACHE_FAMILY.PRICES, CACHE_FAMILY.STATEMENTS]:
+        # Otherwise the shared Toolkit would keep serving the prices and statements it
+        # already downloaded, and they would be cached again under the new generation
+        ToolkitRegistry().discard(ticker)
+    return generation_key(ticker, family)
+
+
 class FMP_CONSTANTS:
     """
     Cashflow statement indices:
@@ -46,6 +92,9 @@ class FMP_CONSTANTS:
     """
     FREE_CASH_FLOW = "Free Cash Flow"
     OPERATING_CASH_FLOW = "Operating Cash Flow"
+    CASH = "Cash and Cash Equivalents"
+    TOTAL_DEBT = "Total Debt"
+    SHARES_OUTSTANDING = "Weighted Average Shares Diluted"
     ROIC = 'Return on Invested Capital'
     ROCE = 'Return on Capital Employed'
 
@@ -54,12 +103,24 @@ class FMP_CONSTANTS:
     OCF_GROWTH = 'OCF Growth'
 
 
+def _format_statement(statement: pd.DataFrame) -> pd.DataFrame:
+    # Period columns are not serializable by pyarrow, so turn them into strings
+    new_headers = [str(period_obj) for period_obj in statement.columns]
+    statement.columns = new_headers
+    return statement.reset_index()
+
+
+def _statement_items(statement: pd.DataFrame) -> pd.DataFrame:
+    # Undo the reset_index of _format_statement to look up line items by name
+    return statement.set_index(statement.columns[0])
+
+
 class StockUtil:
     def get_cashflow_growth_rate(ticker) -> list:
-        toolkit = Toolkit(tickers=[ticker], api_key=API_KEY, quarterly=True)
-        cashflow_growth_ttm = toolkit.get_cash_flow_statement(
+        # Goes through the statement cache, the growth series only changes with a new filing
+        cashflow_growth_ttm = StockData(ticker, quarterly=True).cashflow_statement(
             trailing=4, growth=True)
-        df = cashflow_growth_ttm.loc[['Free Cash Flow']]
+        df = _statement_items(cashflow_growth_ttm).loc[['Free Cash Flow']]
 
         # get the average yoy FCF growth rate over 1y, 3y and 5y
         last1 = df.iloc[:, -1:].mean(axis=1)
@@ -79,16 +140,39 @@ class StockUtil:
 
 class StockData:
     _toolkit: Toolkit = None
+    _generations: dict | None = None
 
     def __init__(self, ticker, quarterly=False):
         self._quarterly = quarterly
-        self._ticker = ticker
-        self._toolkit = Toolkit(
-            tickers=[ticker], quarterly=quarterly, api_key=API_KEY)
+        # Same normalization as StockDataBatch and the ToolkitRegistry keys
+        self._ticker = ticker.upper()
+
+    def _generation_namespaces(self, family) -> list:
+        return [generation_key(self._ticker)] + [
+            generation_key(self._ticker, f) for f in [family] + CACHE_FAMILY.dependencies(family)]
+
+    def _all_generation_namespaces(self) -> list:
+        return [generation_key(self._ticker)] + [
+            generation_key(self._ticker, family) for family in CACHE_FAMILY.as_list()]
+
+    def _get_generations(self, family) -> list:
+        # The counters of every family are read with one MGET and kept for the lifetime of
+        # the instance (one tool call / request), so each cached call costs a single round trip
+        if self._generations is None:
+            namespaces = self._all_generation_namespaces()
+            self._generations = dict(zip(namespaces, CACHE.get_generations(namespaces)))
+        return [self._generations[namespace] for namespace in self._generation_namespaces(family)]
+
+    def _build_cache_key(self, family, function_name, *args, **kwargs):
+        return self._format_cache_key(
+            self._get_generations(family), family, function_name, *args, **kwargs)
 
-    def _build_cache_key(self, function_name, *args, **kwargs):
+    def _format_cache_key(self, generations, family, function_name, *args, **kwargs):
         # Creates a unique key for each function call (include ticker, etc.)
-        key_prefix = f"{self._ticker}_{function_name}_{CACHE_VERSION}"
+        # The generation counters are part of the key so invalidation never has to touch old keys
+        generations = '.'.join(str(gen) for gen in generations)
+        period = 'quarter' if self._quarterly else 'annual'
+        key_prefix = f"{family}:{self._ticker}_{function_name}_{period}_{CACHE_VERSION}_g{generations}"
         if args:
             key_prefix += "_" + "_".join(str(arg) for arg in args)
         if kwargs:
@@ -96,7 +180,7 @@ class StockData:
         return key_prefix
 
     def get_historical_data(self) -> pd.DataFrame:
-        cache_key = self._build_cache_key("get_historical_data")
+        cache_key = self._build_cache_key(CACHE_FAMILY.PRICES, "get_historical_data")
         cached_result = CACHE.get_dataframe(cache_key)
         result = None
         if cached_result is not None:
@@ -108,7 +192,7 @@ class StockData:
         return result
 
     def get_current_price(self) -> float:
-        cache_key = self._build_cache_key("get_current_price")
+        cache_key = self._build_cache_key(CACHE_FAMILY.PRICES, "get_current_price")
         cached_result = CACHE.get(cache_key)
         result = None
         if cached_result is not None:
@@ -124,6 +208,9 @@ class StockData:
         return result
 
     def toolkit(self) -> Toolkit:
+        # Resolved lazily from the shared registry: cache hits never need a Toolkit at all
+        if self._toolkit is None:
+            self._toolkit = get_toolkit(self._ticker, quarterly=self._quarterly)
         result = self._toolkit
         return result
 
@@ -132,19 +219,16 @@ class StockData:
         fcf_growth_rates = StockUtil.get_cashflow_growth_rate(self._ticker)
         low = min(fcf_growth_rates)
         high = max(fcf_growth_rates)
-        low_estimate = self.calculate_dcf_value(
-            growth_rate=low,
-            perpetual_growth_rate=max(
-                math.sqrt(low), 0.03),  # no smaller than 3%
+        # Both scenarios are evaluated in a single vectorized call
+        low_estimate, high_estimate = dcf.intrinsic_values(
+            **self.dcf_inputs(),
+            growth_rate=[low, high*1.1],
+            perpetual_growth_rate=[
+                max(math.sqrt(low), 0.03),  # no smaller than 3%
+                max(math.sqrt(high), 0.05),  # no smaller than 5%
+            ],
+            wacc=[0.08, 0.06],
             periods=10,
-            wacc=0.08
-        )
-        high_estimate = self.calculate_dcf_value(
-            growth_rate=high*1.1,
-            perpetual_growth_rate=max(
-                math.sqrt(high), 0.05),  # no smaller than 5%
-            periods=10,
-            wacc=0.06
         )
         logger.info(
             f'estimate_dcf result:\nlow={low_estimate},high={high_estimate}')
@@ -158,6 +242,85 @@ class StockData:
         logger.warn(f'estimate_dcf: {result}')
         return result
 
+    def dcf_inputs(self) -> dict:
+        """
+        Latest free cash flow, cash, debt and share count from the cached statements,
+        as expected by `sharkfin.util.dcf`
+        """
+        def latest(statement, item):
+            return float(_statement_items(statement).loc[item].iloc[-1])
+
+        # One MGET for the three statements, only the misses go through FinanceToolkit
+        statement_functions = {
+            "cashflow_statement": self.cashflow_statement,
+            "balance_sheet_statement": self.balance_sheet_statement,
+            "income_statement": self.income_statement,
+        }
+        generations = self._get_generations(CACHE_FAMILY.STATEMENTS)
+        cached_results = CACHE.get_dataframes([
+            self._format_cache_key(generations, CACHE_FAMILY.STATEMENTS, name, None, False)
+            for name in statement_functions])
+        cashflow, balance_sheet, income = [
+            cached_result if cached_result is not None else function()
+            for cached_result, function in zip(cached_results, statement_functions.values())]
+        return {
+            'free_cash_flow': latest(cashflow, FMP_CONSTANTS.FREE_CASH_FLOW),
+            'cash': latest(balance_sheet, FMP_CONSTANTS.CASH),
+            'total_debt': latest(balance_sheet, FMP_CONSTANTS.TOTAL_DEBT),
+            'shares_outstanding': latest(income, FMP_CONSTANTS.SHARES_OUTSTANDING),
+        }
+
+    def dcf_sensitivity(
+            self,
+            growth_rates: list | None = None,
+            perpetual_growth_rates: list = [0.02, 0.025, 0.03],
+            waccs: list = [0.06, 0.07, 0.08, 0.09, 0.10],
+            periods: list = [5, 10],
+    ) -> pd.DataFrame:
+        """
+        Intrinsic value for every combination of the parameters.
+        The growth rates default to the range of the historical FCF growth averages.
+        """
+        if growth_rates is None:
+            fcf_growth_rates = StockUtil.get_cashflow_growth_rate(self._ticker)
+            growth_rates = np.linspace(min(fcf_growth_rates), max(fcf_growth_rates), 5)
+
+        result = dcf.sensitivity_grid(
+            self.dcf_inputs(), growth_rates, perpetual_growth_rates, waccs, periods)
+        result['percent of current price'] = result['intrinsic value'] / self.get_current_price()
+        logger.debug(f'dcf_sensitivity: {len(result)} scenarios')
+        return result
+
+    def dcf_monte_carlo(
+            self,
+            growth_rate: tuple | None = None,
+            perpetual_growth_rate: tuple = (0.025, 0.005),
+            wacc: tuple = (0.08, 0.01),
+            periods: int = 10,
+            draws: int = 10000,
+            percentiles: list = dcf.DEFAULT_PERCENTILES,
+    ) -> pd.DataFrame:
+        """
+        Percentile bands of the intrinsic value relative to the current price over
+        `draws` normally distributed (mean, standard deviation) scenarios.
+        The growth rate defaults to the mean and spread of the historical FCF growth averages.
+        """
+        if growth_rate is None:
+            fcf_growth_rates = StockUtil.get_cashflow_growth_rate(self._ticker)
+            growth_rate = (np.mean(fcf_growth_rates), np.std(fcf_growth_rates))
+
+        values = dcf.monte_carlo(
+            self.dcf_inputs(),
+            growth_rate=growth_rate,
+            perpetual_growth_rate=perpetual_growth_rate,
+            wacc=wacc,
+            periods=periods,
+            draws=draws,
+        )
+        result = dcf.percentile_bands(values, self.get_current_price(), percentiles)
+        logger.debug(f'dcf_monte_carlo:\n{result}')
+        return result
+
     def calculate_dcf_value(
             self,
             growth_rate: float = 0.11,
@@ -166,7 +329,7 @@ class StockData:
             periods: int = 10,
     ) -> float:
         cache_key = self._build_cache_key(
-            "calculate_dcf_value", growth_rate, perpetual_growth_rate, wacc, periods)
+            CACHE_FAMILY.MODELS, "calculate_dcf_value", growth_rate, perpetual_growth_rate, wacc, periods)
         cached_result = CACHE.get(cache_key)
         result = None
         if cached_result is not None:
@@ -181,7 +344,7 @@ class StockData:
                 rounding=2,
             )
 
-            logger.debug(f'dcf_valuation dataframe: {dcf_valuation}')
+            logger.debug(f'dcf_valuation dataframe: shape={dcf_valuation.shape}')
             result = float(
                 dcf_valuation.loc[(self._ticker, 'Intrinsic Value')])
             logger.warn(result)
@@ -191,7 +354,7 @@ class StockData:
 
     def cashflow_statement(self, trailing: int | None = None, growth=False) -> pd.DataFrame:
         cache_key = self._build_cache_key(
-            "cashflow_statement", trailing, growth)
+            CACHE_FAMILY.STATEMENTS, "cashflow_statement", trailing, growth)
         cached_result = CACHE.get_dataframe(cache_key)
 
         result = None
@@ -199,42 +362,53 @@ class StockData:
             result = cached_result
         else:
             result = self.toolkit().get_cash_flow_statement(
-                overwrite=True,  # todo: might be worth playing with
                 growth=growth,
                 trailing=trailing
             )
-            new_headers = [str(period_obj) for period_obj in result.columns]
-            result.columns = new_headers
-            result = result.reset_index()
+            result = _format_statement(result)
             CACHE.set_dataframe(cache_key, result, ex=CACHE_TTL_1WEEK)
 
-        logger.debug(f'cashflow_statement:\n{result}')
+        logger.debug(f'cashflow_statement: shape={result.shape}')
         return result
 
     def income_statement(self, trailing: int | None = None, growth=False) -> pd.DataFrame:
         cache_key = self._build_cache_key(
-            "income_statement", trailing, growth)
+            CACHE_FAMILY.STATEMENTS, "income_statement", trailing, growth)
         cached_result = CACHE.get_dataframe(cache_key)
         result = None
         if cached_result is not None:
             result = cached_result
         else:
             result = self.toolkit().get_income_statement(
-                overwrite=True,  # todo: might be worth playing with
                 growth=growth,
                 trailing=trailing
             )
+            result = _format_statement(result)
+            CACHE.set_dataframe(cache_key, result, ex=CACHE_TTL_1WEEK)
 
-            new_headers = [str(period_obj) for period_obj in result.columns]
-            result.columns = new_headers
-            result = result.reset_index()
+        logger.debug(f'income_statement: shape={result.shape}')
+        return result
+
+    def balance_sheet_statement(self, trailing: int | None = None, growth=False) -> pd.DataFrame:
+        cache_key = self._build_cache_key(
+            CACHE_FAMILY.STATEMENTS, "balance_sheet_statement", trailing, growth)
+        cached_result = CACHE.get_dataframe(cache_key)
+        result = None
+        if cached_result is not None:
+            result = cached_result
+        else:
+            result = self.toolkit().get_balance_sheet_statement(
+                growth=growth,
+                trailing=trailing
+            )
+            result = _format_statement(result)
             CACHE.set_dataframe(cache_key, result, ex=CACHE_TTL_1WEEK)
 
-        logger.debug(f'income_statement:\n{result}')
+        logger.debug(f'balance_sheet_statement: shape={result.shape}')
         return result
 
     def get_piotroski_score(self):
-        cache_key = self._build_cache_key("get_piotroski_score")
+        cache_key = self._build_cache_key(CACHE_FAMILY.MODELS, "get_piotroski_score")
         cached_result = CACHE.get_dataframe(cache_key)
         result = None
         if cached_result is not None:
@@ -246,5 +420,107 @@ class StockData:
             result = result.reset_index().drop('level_0', axis=1)
             CACHE.set_dataframe(cache_key, result, ex=CACHE_TTL_1WEEK)
 
-        logger.debug(f'get_piotroski_score:\n{result}')
+        logger.debug(f'get_piotroski_score: shape={result.shape}')
         return result
+
+
+class StockDataBatch:
+    """
+    Same data as StockData, but for many tickers at once. Tickers that miss the
+    cache are retrieved through a single Toolkit and the result is split back
+    into the per-ticker cache entries StockData reads, e.g. for peer comparisons.
+    """
+
+    def __init__(self, tickers: list, quarterly=False):
+        self._quarterly = quarterly
+        self._tickers = list(dict.fromkeys(ticker.upper() for ticker in tickers))
+        self._stocks = {ticker: StockData(ticker, quarterly=quarterly)
+                        for ticker in self._tickers}
+
+    def stock(self, ticker) -> StockData:
+        return self._stocks[ticker.upper()]
+
+    def _load_generations(self):
+        # One MGET for the generation counters of every ticker and family, shared by the
+        # StockData instances so later calls on the batch or its stocks reuse them
+        stocks = [stock for stock in self._stocks.values() if stock._generations is None]
+        if not stocks:
+            return
+        namespaces = [stock._all_generation_namespaces() for stock in stocks]
+        generations = iter(CACHE.get_generations(
+            [namespace for stock_namespaces in namespaces for namespace in stock_namespaces]))
+        for stock, stock_namespaces in zip(stocks, namespaces):
+            stock._generations = {namespace: next(generations) for namespace in stock_namespaces}
+
+    def _build_cache_keys(self, family, function_name, *args) -> dict:
+        self._load_generations()
+        return {
+            ticker: stock._build_cache_key(family, function_name, *args)
+            for ticker, stock in self._stocks.items()
+        }
+
+    def _get_batched(self, family, function_name, fetch, split, ex, *args) -> dict:
+        cache_keys = self._build_cache_keys(family, function_name, *args)
+        cached_results = CACHE.get_dataframes(list(cache_keys.values()))
+        results = {ticker: cached_result
+                    for ticker, cached_result in zip(cache_keys, cached_results)
+                    if cached_result is not None}
+        missing = [ticker for ticker in cache_keys if ticker not in results]
+
+        if missing:
+            logger.info(f'{function_name}: batch retrieval for {missing}')
+            combined = fetch(get_toolkit(missing, quarterly=self._quarterly))
+            for ticker in missing:
+                try:
+                    results[ticker] = split(combined, ticker, len(missing) > 1)
+                except KeyError:
+                    logger.warning(f'{function_name}: no data for {ticker}')
+            CACHE.set_dataframes(
+                {cache_keys[ticker]: results[ticker] for ticker in missing if ticker in results}, ex=ex)
+
+        return results
+
+    @staticmethod
+    def _split_statement(combined: pd.DataFrame, ticker, multi_ticker: bool) -> pd.DataFrame:
+        # Multi-ticker statements are indexed by (ticker, item), single ticker ones by item only
+        if not multi_ticker:
+            return _format_statement(combined.copy())
+        # Columns span every ticker's periods: drop the ones this ticker did not report,
+        # StockData reads these entries and takes the last column as the latest period
+        return _format_statement(combined.loc[ticker].dropna(axis=1, how='all').copy())
+
+    @staticmethod
+    def _split_historical_data(combined: pd.DataFrame, ticker, multi_ticker: bool) -> pd.DataFrame:
+        # Keep the (field, ticker) columns of a single ticker Toolkit, including the benchmark
+        if not multi_ticker:
+            return combined
+        if ticker not in combined.columns.get_level_values(1):
+            raise KeyError(ticker)
+        return combined.loc[:, combined.columns.get_level_values(1).isin([ticker, 'Benchmark'])]
+
+    def get_historical_data(self) -> dict:
+        return self._get_batched(
+            CACHE_FAMILY.PRICES, "get_historical_data",
+            lambda toolkit: toolkit.get_historical_data(),
+            self._split_historical_data, CACHE_TTL_1DAY)
+
+    def cashflow_statement(self, trailing: int | None = None, growth=False) -> dict:
+        return self._get_batched(
+            CACHE_FAMILY.STATEMENTS, "cashflow_statement",
+            lambda toolkit: toolkit.get_cash_flow_statement(
+                growth=growth, trailing=trailing),
+            self._split_statement, CACHE_TTL_1WEEK, trailing, growth)
+
+    def income_statement(self, trailing: int | None = None, growth=False) -> dict:
+        return self._get_batched(
+            CACHE_FAMILY.STATEMENTS, "income_statement",
+            lambda toolkit: toolkit.get_income_statement(
+                growth=growth, trailing=trailing),
+            self._split_statement, CACHE_TTL_1WEEK, trailing, growth)
+
+    def balance_sheet_statement(self, trailing: int | None = None, growth=False) -> dict:
+        return self._get_batched(
+            CACHE_FAMILY.STATEMENTS, "balance_sheet_statement",
+            lambda toolkit: toolkit.get_balance_sheet_statement(
+                growth=growth, trailing=trailing),
+            self._split_statement, CACHE_TTL_1WEEK, trailing, growth)
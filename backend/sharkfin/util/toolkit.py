@@ -0,0 +1,86 @@
+# https://github.com/JerBouma/FinanceToolkit
+from financetoolkit import Toolkit
+from collections import OrderedDict
+import os
+import threading
+import time
+
+from sharkfin.util.logger import Log
+
+logger = Log().get_logger()
+
+API_KEY = os.getenv('FMP_API_KEY')
+
+# A Toolkit keeps every statement it downloaded in memory, so keep the registry small
+# and let entries expire so long running processes eventually see new filings.
+TOOLKIT_REGISTRY_MAX_SIZE = int(
+    os.environ.get('SHARKFIN_TOOLKIT_REGISTRY_MAX_SIZE', 32))
+TOOLKIT_REGISTRY_TTL = int(
+    os.environ.get('SHARKFIN_TOOLKIT_REGISTRY_TTL', 60 * 60))
+
+
+class ToolkitRegistry:
+    """
+    Process-wide LRU of Toolkit objects keyed by (tickers, quarterly).
+
+    Toolkit caches the statements it retrieved, so handing out the same instance
+    to StockData and StockUtil means each statement is downloaded once per
+    ticker and periodicity instead of once per call.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._toolkits = OrderedDict()
+            cls._instance._lock = threading.Lock()
+        return cls._instance
+
+    @staticmethod
+    def _build_key(tickers, quarterly: bool) -> tuple:
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        return (tuple(sorted(ticker.upper() for ticker in tickers)), bool(quarterly))
+
+    def get(self, tickers, quarterly: bool = False) -> Toolkit:
+        key = self._build_key(tickers, quarterly)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._toolkits.get(key)
+            if entry is not None:
+                toolkit, created_at = entry
+                if now - created_at < TOOLKIT_REGISTRY_TTL:
+                    self._toolkits.move_to_end(key)
+                    return toolkit
+                logger.debug(f'ToolkitRegistry: expired {key}')
+                del self._toolkits[key]
+
+            toolkit = Toolkit(
+                tickers=list(key[0]), quarterly=quarterly, api_key=API_KEY)
+            self._toolkits[key] = (toolkit, now)
+            while len(self._toolkits) > TOOLKIT_REGISTRY_MAX_SIZE:
+                evicted, _ = self._toolkits.popitem(last=False)
+                logger.debug(f'ToolkitRegistry: evicted {evicted}')
+            return toolkit
+
+    def discard(self, tickers, quarterly: bool | None = None):
+        """ Drops every cached toolkit holding any of the tickers, including multi-ticker
+        ones built by StockDataBatch, for both periodicities unless one is given
+        """
+        symbols = set(self._build_key(tickers, False)[0])
+        periodicities = [True, False] if quarterly is None else [bool(quarterly)]
+        with self._lock:
+            stale = [key for key in self._toolkits
+                     if key[1] in periodicities and symbols.intersection(key[0])]
+            for key in stale:
+                logger.debug(f'ToolkitRegistry: discarded {key}')
+                del self._toolkits[key]
+
+    def clear(self):
+        with self._lock:
+            self._toolkits.clear()
+
+
+def get_toolkit(tickers, quarterly: bool = False) -> Toolkit:
+    return ToolkitRegistry().get(tickers, quarterly=quarterly)
@@ -1,57 +1,259 @@
+from langchain_core.documents import Document
 from langchain_core.tools import tool
-from langchain_openai import OpenAIEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import Chroma
+from chromadb import Settings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from typing import List
+import chromadb
 import datetime
+import hashlib
+import json
+import os
+import threading
+from sharkfin.util.bm25 import BM25Index, reciprocal_rank_fusion
+from sharkfin.util.cache import RedisCache
+from sharkfin.util.embeddings import EMBEDDING_BACKEND, embeddings_id, get_embeddings
 from sharkfin.util.fmp import FMP
 from sharkfin.util.logger import Log
+from sharkfin.util.transcript_digest import get_transcript_digest
 
 logger = Log().get_logger()
 
+CACHE = RedisCache()
+CACHE_TTL_1DAY = 24 * 60 * 60
+
+TRANSCRIPT_FETCH_CONCURRENCY = int(
+    os.environ.get('SHARKFIN_TRANSCRIPT_FETCH_CONCURRENCY', 4))
+
+TRANSCRIPT_INDEX_DIR = os.path.join(
+    os.getenv('DATA_DIR', './data'), 'sharkfin', 'transcripts')
+
+# Hybrid search: candidates taken from each retriever before the rank fusion, and results returned
+HYBRID_SEARCH_CANDIDATES = 20
+HYBRID_SEARCH_K = 3
+
+# (symbol, embeddings id) -> keyword index over all of its indexed chunks, least recently used first.
+# Rebuilt after new chunks are indexed
+BM25_INDEX_CACHE_SIZE = 64
+_bm25_corpora = OrderedDict()
+_bm25_corpora_lock = threading.Lock()
+
+
+def _is_year_complete(year, quarters) -> bool:
+    """
+    Whether a fiscal year will not get new transcripts anymore: all four quarters are
+    out, or its grace window is over (Q4 and offset fiscal years are published in N+1).
+    """
+    return len(set(int(quarter) for quarter in quarters)) >= 4 \
+        or int(year) < datetime.datetime.now().year - 1
+
+
+def _get_batch_earnings_transcript(symbol: str, year) -> list:
+    cache_key = f'transcripts:{symbol}_{year}_batch'
+    cached_result = CACHE.get(cache_key)
+    if cached_result is not None:
+        return json.loads(cached_result)
+
+    transcript = FMP.get_batch_earnings_call_transcript(symbol=symbol, year=year)
+    if len(transcript) > 0:
+        # Complete fiscal years are immutable, so they are cached indefinitely
+        complete = _is_year_complete(year, [item['quarter'] for item in transcript])
+        ex = None if complete else CACHE_TTL_1DAY
+        CACHE.set(cache_key, json.dumps(transcript), ex=ex)
+    return transcript
+
+
+def iter_batch_earnings_transcript_multiyear(symbol: str, years: List[str]):
+    """
+    Downloads the years concurrently (at most TRANSCRIPT_FETCH_CONCURRENCY at a time)
+    and yields each transcript as soon as its year has arrived.
+    """
+    if len(years) == 0:
+        return
+
+    with ThreadPoolExecutor(max_workers=min(TRANSCRIPT_FETCH_CONCURRENCY, len(years))) as executor:
+        futures = {executor.submit(_get_batch_earnings_transcript, symbol, year): year
+                   for year in years}
+        for future in as_completed(futures):
+            year = futures[future]
+            try:
+                yield from future.result()
+            except Exception as e:
+                logger.error(
+                    f"Failed to get transcript data for year {year} and ticker {symbol}: {e}")
+
 
 def get_batch_earnings_transcript_multiyear(symbol: str, years: List[str]):
-    transcripts = []
-    for year in years:
-        try:
-            transcript = FMP.get_batch_earnings_call_transcript(
-                symbol=symbol, year=year)
-            if len(transcript) > 0:
-                transcripts.extend(transcript)
-        except Exception as e:
-            logger.error(
-                f"Failed to get transcript data for year {year} and ticker {symbol}: {e}")
-    return transcripts
-
-
-def _search_earnings_transcripts(query: str, symbol: str, years: List[str]):
-    transcripts = get_batch_earnings_transcript_multiyear(symbol, years)
+    return list(iter_batch_earnings_transcript_multiyear(symbol, years))
+
+
+def _transcript_chunk_id(text: str) -> str:
+    # Chunks are keyed by content so each one is embedded once, no matter how often it is indexed
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
 
+@lru_cache(maxsize=None)
+def _get_chroma_client():
+    return chromadb.PersistentClient(
+        path=TRANSCRIPT_INDEX_DIR,
+        settings=Settings(anonymized_telemetry=False),
+    )
+
+
+@lru_cache(maxsize=128)
+def _get_transcript_index(symbol: str, embedding_id: str) -> Chroma:
+    """ Persistent per-symbol vector index of earnings call transcript chunks
+    """
+    collection_name = f'transcripts-{symbol}'
+    if embedding_id != EMBEDDING_BACKEND.OPENAI:
+        # A different embedding space needs its own collection
+        collection_name += f'-{embedding_id}'
+    return Chroma(
+        client=_get_chroma_client(),
+        collection_name=collection_name,
+        embedding_function=get_embeddings(),
+    )
+
+
+def chunk_transcripts(transcripts) -> tuple:
+    """
+    Chunks the transcripts as they come in, deduplicated by content.
+
+    Returns:
+        (chunk id -> (text, metadata), year -> quarters that had a transcript)
+    """
     # Split into chunks with `chunk_size` tokens each, and `chunk_overlap` tokens overlap between successive chunks,
     # we might want to experiment with different parameters.
     text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
         chunk_size=150, chunk_overlap=22)
 
-    all_documents = []
+    chunks = {}
+    years = {}
     for transcript in transcripts:
-        # Split each earnings call transcript into document chunks and store it in texts
-        documents = text_splitter.create_documents([transcript['content']])
-        for document in documents:  # The split chunks are called documents
+        years.setdefault(int(transcript['year']), set()).add(int(transcript['quarter']))
+        # Split each earnings call transcript into document chunks
+        for document in text_splitter.create_documents([transcript['content']]):
             # Add ticker symbol and date of earnings call to the metadata of each document
             # to easily identify its source in future
-            document.metadata = {
-                "title": f"{transcript['symbol']} Earnings Call: {transcript['date']}"}
-        # Add all the documents into document list of all news articles
-        all_documents.extend(documents)
+            chunks.setdefault(_transcript_chunk_id(document.page_content), (document.page_content, {
+                "title": f"{transcript['symbol']} Earnings Call: {transcript['date']}",
+                "symbol": transcript['symbol'],
+                "year": int(transcript['year']),
+                "quarter": int(transcript['quarter']),
+            }))
+    return chunks, years
+
+
+def _index_transcripts(db: Chroma, transcripts) -> dict:
+    """
+    Embeds the chunks that are not indexed yet.
+
+    Returns:
+        year -> quarters that had a transcript
+    """
+    chunks, years = chunk_transcripts(transcripts)
+    if len(chunks) == 0:
+        return years
+
+    existing_ids = set(db.get(ids=list(chunks.keys()), include=[])['ids'])
+    new_ids = [chunk_id for chunk_id in chunks if chunk_id not in existing_ids]
+    if new_ids:
+        db.add_texts(
+            texts=[chunks[chunk_id][0] for chunk_id in new_ids],
+            metadatas=[chunks[chunk_id][1] for chunk_id in new_ids],
+            ids=new_ids,
+        )
+    logger.info(f'_index_transcripts: {len(new_ids)} new chunks, {len(existing_ids)} already indexed')
+    return years
+
+
+def _ensure_transcripts_indexed(db: Chroma, symbol: str, years: List[int], embedding_id: str) -> bool:
+    """
+    Downloads and indexes the years that were not indexed yet. Incomplete years are
+    re-checked once a day for new quarters, complete years are indexed once.
+
+    Returns:
+        Whether anything had to be indexed
+    """
+    marker_keys = [f'transcripts:{symbol}_{year}_indexed_{embedding_id}' for year in years]
+    markers = CACHE.get_many(marker_keys)
+    missing_years = [year for year, marker in zip(years, markers) if marker is None]
+    if len(missing_years) == 0:
+        return False
+
+    indexed_years = _index_transcripts(
+        db, iter_batch_earnings_transcript_multiyear(symbol, missing_years))
+
+    # Years that failed to download or have no transcript yet are retried on the next search
+    indexed_markers = {marker_key: year for year, marker_key in zip(years, marker_keys)
+                       if year in missing_years and year in indexed_years}
+    if indexed_markers:
+        CACHE.set_many(
+            {marker_key: 1 for marker_key in indexed_markers},
+            ex={marker_key: None if _is_year_complete(year, indexed_years[year]) else CACHE_TTL_1DAY
+                for marker_key, year in indexed_markers.items()})
+    return True
+
+
+def _get_bm25_corpus(db: Chroma, index_key: tuple) -> dict:
+    with _bm25_corpora_lock:
+        corpus = _bm25_corpora.get(index_key)
+        if corpus is not None:
+            _bm25_corpora.move_to_end(index_key)
+            return corpus
+
+    # Built outside of the lock, searches on other symbols are not held up meanwhile
+    data = db.get(include=['documents', 'metadatas'])
+    corpus = {
+        'ids': data['ids'],
+        'documents': data['documents'],
+        'metadatas': data['metadatas'],
+        'positions': {chunk_id: position for position, chunk_id in enumerate(data['ids'])},
+        'index': BM25Index(data['documents']),
+    }
+    with _bm25_corpora_lock:
+        _bm25_corpora[index_key] = corpus
+        while len(_bm25_corpora) > BM25_INDEX_CACHE_SIZE:
+            _bm25_corpora.popitem(last=False)
+    return corpus
+
+
+def _search_earnings_transcripts(query: str, symbol: str, years: List[str], k: int = HYBRID_SEARCH_K):
+    """
+    Hybrid search: BM25 catches exact terms and figures ("capex", "Q3 gross margin") that
+    dense similarity over short chunks misses. Both rankings are merged with reciprocal rank fusion.
+    """
+    symbol = symbol.upper()
+    years = sorted({int(year) for year in years})
+    # Resolved once: the RAG app may switch the local embedding model in the meantime
+    embedding_id = embeddings_id()
+    index_key = (symbol, embedding_id)
+    db = _get_transcript_index(symbol, embedding_id)
+    if _ensure_transcripts_indexed(db, symbol, years, embedding_id):
+        with _bm25_corpora_lock:
+            _bm25_corpora.pop(index_key, None)
 
-    if len(all_documents) == 0:
-        return []
+    corpus = _get_bm25_corpus(db, index_key)
+    allowed = {position for position, metadata in enumerate(corpus['metadatas'])
+               if metadata.get('year') in years}
+    keyword_ranking = [corpus['ids'][position] for position, _ in
+                       corpus['index'].search(query, HYBRID_SEARCH_CANDIDATES, allowed)]
 
-    db = Chroma.from_documents(all_documents, OpenAIEmbeddings())
+    vector_docs = db.similarity_search(
+        query, k=HYBRID_SEARCH_CANDIDATES, filter={"year": {"$in": years}})
+    vector_ranking = [_transcript_chunk_id(doc.page_content) for doc in vector_docs]
 
-    # k=4 means the similarity_search function will return the 4 most similar items
-    # from the database based on their vector representations
-    similar_docs = db.similarity_search(query, k=4)
+    documents = {chunk_id: doc for chunk_id, doc in zip(vector_ranking, vector_docs)}
+    similar_docs = []
+    for chunk_id, _ in reciprocal_rank_fusion([keyword_ranking, vector_ranking])[:k]:
+        if chunk_id not in documents:
+            position = corpus['positions'][chunk_id]
+            documents[chunk_id] = Document(
+                page_content=corpus['documents'][position], metadata=corpus['metadatas'][position])
+        similar_docs.append(documents[chunk_id])
     return similar_docs
 
 
@@ -68,13 +270,17 @@ def get_earnings_transcript_summary(symbol: str, year: int | None = None, quarte
     Returns:
         str: The summarized earnings call transcript text for the latest (default) quarter or the specified quarter
     """
-    transcript = FMP.get_earning_call_transcript(
-        symbol=symbol, year=year, quarter=quarter)
+    # Precomputed digest instead of the raw transcript: a fraction of the prompt tokens
+    digest = get_transcript_digest(symbol=symbol, year=year, quarter=quarter)
+    if digest is None:
+        return f"No earnings call transcript was found for ${symbol}."
 
     return f'''
-        Here's the earnings data for ${symbol}:\n{transcript}.
-        The date of the earning call was [TODO: Fill date]
+        Here's a digest of the earnings call for ${symbol} (year {digest['year']}, quarter {digest['quarter']}):\n{json.dumps(digest)}.
+        The date of the earning call was {digest['date']}
 
+        The digest contains verbatim sentences from the call: `key_metrics`, `guidance`, the most relevant
+        `highlights` of each speaker, and a lexicon based `sentiment` score per section of the call.
         Next steps: write the following sections based on the data above
             1. Key Metrics: Note down all key metrics such as revenue and revenue growth, EPS and EPS growth.
             2. Guidance: Note down the management guidance for the upcoming quarter or year
@@ -0,0 +1,243 @@
+from collections import Counter, OrderedDict
+import json
+import re
+
+from sharkfin.util.cache import RedisCache
+from sharkfin.util.fmp import FMP
+from sharkfin.util.logger import Log
+
+logger = Log().get_logger()
+
+CACHE = RedisCache()
+CACHE_TTL_1DAY = 24 * 60 * 60
+
+# Bump when the digest format changes, published transcripts themselves never change
+DIGEST_VERSION = 1
+
+MAX_KEY_METRICS = 12
+MAX_GUIDANCE = 8
+MAX_HIGHLIGHTS_PER_SPEAKER = 2
+MAX_SPEAKERS = 10
+MAX_SENTENCE_LENGTH = 400
+
+SPEAKER_LINE = re.compile(r'^([A-Z][\w.\'-]*(?: [\w.\'-]+){0,5}):\s+(.*)$')
+SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+(?=[A-Z"])')
+NUMBER = re.compile(r'\$?\d[\d,]*(?:\.\d+)?\s?(?:%|percent|billion|million|bps|basis points)?', re.IGNORECASE)
+QA_START = re.compile(r'question[- ]and[- ]answer|first question|open (?:up )?the (?:line|call) for questions',
+                      re.IGNORECASE)
+
+METRIC_TERMS = re.compile(
+    r'\b(revenue|sales|eps|earnings per share|gross margin|operating margin|operating income|net income|'
+    r'free cash flow|cash flow|ebitda|bookings|backlog|subscribers|users|capex|capital expenditure)',
+    re.IGNORECASE)
+GUIDANCE_TERMS = re.compile(
+    r'\b(guidance|outlook|expect|anticipate|forecast|project|next quarter|full year|fiscal (?:year )?\d{2,4}|'
+    r'going forward)',
+    re.IGNORECASE)
+
+# Small finance sentiment lexicon in the spirit of Loughran-McDonald
+POSITIVE_WORDS = {
+    'record', 'strong', 'growth', 'grew', 'increase', 'increased', 'improve', 'improved', 'improvement',
+    'exceed', 'exceeded', 'beat', 'momentum', 'robust', 'outperform', 'accelerate', 'accelerated',
+    'expand', 'expanded', 'expansion', 'gain', 'gains', 'healthy', 'confident', 'opportunity', 'solid',
+}
+NEGATIVE_WORDS = {
+    'decline', 'declined', 'decrease', 'decreased', 'weak', 'weakness', 'headwind', 'headwinds',
+    'challenging', 'challenge', 'loss', 'losses', 'lower', 'miss', 'missed', 'pressure', 'slowdown',
+    'uncertain', 'uncertainty', 'difficult', 'impairment', 'restructuring', 'softness', 'soft', 'risk',
+}
+
+
+def _split_sentences(text: str) -> list:
+    return [sentence.strip()[:MAX_SENTENCE_LENGTH] for sentence in SENTENCE_SPLIT.split(text) if sentence.strip()]
+
+
+def _split_speaker_turns(content: str) -> list:
+    """
+    FMP transcripts have one `Speaker Name: text` paragraph per turn.
+
+    Returns:
+        (speaker, section, text) per turn, section is `prepared remarks` or `q&a`
+    """
+    turns = []
+    section = 'prepared remarks'
+    for line in content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        match = SPEAKER_LINE.match(line)
+        if match:
+            speaker, text = match.groups()
+        elif turns:
+            # continuation of the previous turn
+            speaker, _, text = turns.pop()
+            text = f'{text} {line}'
+        else:
+            speaker, text = 'Unknown', line
+        if speaker == 'Operator' and QA_START.search(text):
+            section = 'q&a'
+        turns.append((speaker, section, text))
+    return turns
+
+
+def _salience(sentence: str) -> int:
+    return (2 * len(NUMBER.findall(sentence)) + len(METRIC_TERMS.findall(sentence))
+            + len(GUIDANCE_TERMS.findall(sentence)))
+
+
+def _sentiment(text: str) -> dict:
+    words = Counter(re.findall(r'[a-z]+', text.lower()))
+    positive = sum(words[word] for word in POSITIVE_WORDS)
+    negative = sum(words[word] for word in NEGATIVE_WORDS)
+    score = (positive - negative) / (positive + negative) if positive + negative else 0.0
+    label = 'positive' if score > 0.2 else 'negative' if score < -0.2 else 'neutral'
+    return {'label': label, 'score': round(score, 3), 'positive_terms': positive, 'negative_terms': negative}
+
+
+def build_transcript_digest(transcript: dict) -> dict:
+    """
+    Extractive, section-aware digest of one earnings call: key metric and guidance
+    sentences, lexicon sentiment per section, and the most salient sentences per speaker.
+    A fraction of the size of the raw transcript.
+    """
+    turns = _split_speaker_turns(transcript['content'])
+
+    key_metrics = []
+    guidance = []
+    speakers = OrderedDict()
+    section_text = {'prepared remarks': [], 'q&a': []}
+    for speaker, section, text in turns:
+        section_text[section].append(text)
+        if speaker == 'Operator':
+            continue
+        speaker_entry = speakers.setdefault(speaker, {'words': 0, 'sections': set(), 'sentences': []})
+        speaker_entry['words'] += len(text.split())
+        speaker_entry['sections'].add(section)
+        for sentence in _split_sentences(text):
+            has_number = NUMBER.search(sentence) is not None
+            if has_number and METRIC_TERMS.search(sentence) and sentence not in key_metrics:
+                key_metrics.append(sentence)
+            if GUIDANCE_TERMS.search(sentence) and sentence not in guidance:
+                guidance.append(sentence)
+            speaker_entry['sentences'].append(sentence)
+
+    # Most talkative speakers first, they are management on virtually every call
+    top_speakers = sorted(speakers.items(), key=lambda item: item[1]['words'], reverse=True)[:MAX_SPEAKERS]
+
+    return {
+        'symbol': transcript.get('symbol'),
+        'year': transcript.get('year'),
+        'quarter': transcript.get('quarter'),
+        'date': transcript.get('date'),
+        'key_metrics': sorted(key_metrics, key=_salience, reverse=True)[:MAX_KEY_METRICS],
+        'guidance': sorted(guidance, key=_salience, reverse=True)[:MAX_GUIDANCE],
+        'sentiment': {
+            section: _sentiment(' '.join(texts)) for section, texts in section_text.items() if texts
+        },
+        'speakers': [
+            {
+                'name': name,
+                'sections': sorted(entry['sections']),
+                'words': entry['words'],
+                'highlights': sorted(entry['sentences'], key=_salience, reverse=True)[:MAX_HIGHLIGHTS_PER_SPEAKER],
+            }
+            for name, entry in top_speakers
+        ],
+    }
+
+
+def _digest_cache_key(symbol, year, quarter) -> str:
+    return f'transcripts:{symbol}_{year}_Q{quarter}_digest_v{DIGEST_VERSION}'
+
+
+def _latest_cache_key(symbol) -> str:
+    return f'transcripts:{symbol}_latest'
+
+
+def _year_cache_key(symbol, year) -> str:
+    # The call FMP picks when only the year is given
+    return f'transcripts:{symbol}_{year}_resolved'
+
+
+def _get_resolved_digest(symbol, resolved_cache_key) -> dict | None:
+    """ Digest of the [year, quarter] recorded under `resolved_cache_key`, if both are cached
+    """
+    resolved = CACHE.get(resolved_cache_key)
+    if resolved is None:
+        return None
+    cached_result = CACHE.get(_digest_cache_key(symbol, *json.loads(resolved)))
+    return json.loads(cached_result) if cached_result is not None else None
+
+
+def _build_and_store(symbol: str, year: int | None = None, quarter: int | None = None) -> dict | None:
+    transcripts = FMP.get_earning_call_transcript(symbol=symbol, year=year, quarter=quarter)
+    if not transcripts:
+        return None
+
+    transcript = transcripts[0]
+    digest = build_transcript_digest(transcript)
+    # Transcripts never change once published, so the digest is kept forever
+    CACHE.set(_digest_cache_key(symbol, transcript['year'], transcript['quarter']),
+              json.dumps(digest), ex=None)
+    logger.info(
+        f"transcript digest for {symbol} {transcript['year']} Q{transcript['quarter']}: "
+        f"{len(transcript['content'])} chars -> {len(json.dumps(digest))} chars")
+    return digest
+
+
+def refresh_latest_transcript_digest(symbol: str) -> dict | None:
+    """
+    Background job: makes sure the digest of the latest call exists and records which one
+    is the latest, so `get_transcript_digest` can answer without calling FMP.
+    """
+    symbol = symbol.upper()
+    transcripts = FMP.get_earning_call_transcript(symbol=symbol)
+    if not transcripts:
+        return None
+
+    year, quarter = transcripts[0]['year'], transcripts[0]['quarter']
+    cached_result = CACHE.get(_digest_cache_key(symbol, year, quarter))
+    if cached_result is not None:
+        digest = json.loads(cached_result)
+    else:
+        digest = build_transcript_digest(transcripts[0])
+        CACHE.set(_digest_cache_key(symbol, year, quarter), json.dumps(digest), ex=None)
+    CACHE.set(_latest_cache_key(symbol), json.dumps([year, quarter]), ex=CACHE_TTL_1DAY)
+    return digest
+
+
+def get_transcript_digest(symbol: str, year: int | None = None, quarter: int | None = None) -> dict | None:
+    """
+    Cached digest of a call, or of the latest call when year/quarter are omitted.
+    On a miss the digest is built once and cached.
+    """
+    symbol = symbol.upper()
+    if quarter and not year:
+        # The most recent call of that quarter: this year's if it already happened, else last year's
+        latest = get_transcript_digest(symbol)
+        if latest is None:
+            return None
+        latest_year, latest_quarter = int(latest['year']), int(latest['quarter'])
+        year = latest_year if int(quarter) <= latest_quarter else latest_year - 1
+
+    if year and quarter:
+        cached_result = CACHE.get(_digest_cache_key(symbol, year, quarter))
+        if cached_result is not None:
+            return json.loads(cached_result)
+        return _build_and_store(symbol, year, quarter)
+
+    if not year:
+        digest = _get_resolved_digest(symbol, _latest_cache_key(symbol))
+        if digest is not None:
+            return digest
+        return refresh_latest_transcript_digest(symbol)
+
+    # Only the year: the FMP endpoint picks the call, remembered like the latest one
+    digest = _get_resolved_digest(symbol, _year_cache_key(symbol, year))
+    if digest is not None:
+        return digest
+    digest = _build_and_store(symbol, year)
+    if digest is not None:
+        CACHE.set(_year_cache_key(symbol, year), json.dumps([digest['year'], digest['quarter']]),
+                  ex=CACHE_TTL_1DAY)
+    return digest
@@ -27,6 +27,16 @@ def calculate_sha256(file):
     return sha256.hexdigest()
 
 
+def save_file_and_calculate_sha256(file, file_path, chunk_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    # Stream to disk in chunks, hashing on the way, the file is never fully in memory
+    with open(file_path, "wb") as f:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            sha256.update(chunk)
+            f.write(chunk)
+    return sha256.hexdigest()
+
+
 def calculate_sha256_string(string):
     # Create a new SHA-256 hash object
     sha256_hash = hashlib.sha256()
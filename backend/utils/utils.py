@@ -7,6 +7,7 @@ from constants import ERROR_MESSAGES
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 import requests
+import hmac
 import jwt
 import logging
 import config
@@ -101,3 +102,14 @@ def get_admin_user(user=Depends(get_current_user)):
             detail=ERROR_MESSAGES.ACCESS_PROHIBITED,
         )
     return user
+
+
+def get_metrics_user(
+    auth_token: HTTPAuthorizationCredentials = Depends(bearer_security),
+):
+    # Scrapers cannot log in, they authenticate with METRICS_TOKEN instead of a user token
+    if config.METRICS_TOKEN and hmac.compare_digest(
+        auth_token.credentials.encode(), config.METRICS_TOKEN.encode()
+    ):
+        return None
+    return get_admin_user(get_current_user(auth_token))
@@ -1,4 +1,5 @@
 import { RAG_API_BASE_URL } from '$lib/constants';
+import { splitStream } from '$lib/utils';
 
 export const getChunkParams = async (token: string) => {
 	let error = null;
@@ -147,10 +148,17 @@ export const updateQuerySettings = async (token: string, settings: QuerySettings
 	return res;
 };
 
-export const uploadDocToVectorDB = async (token: string, collection_name: string, file: File) => {
+export const uploadDocToVectorDB = async (
+	token: string,
+	collection_name: string,
+	file: File,
+	onProgress: Function | null = null
+) => {
 	const data = new FormData();
 	data.append('file', file);
 	data.append('collection_name', collection_name);
+	// parsing and embedding run in the server's ingestion queue, followed below
+	data.append('background', 'true');
 
 	let error = null;
 
@@ -176,9 +184,70 @@ export const uploadDocToVectorDB = async (token: string, collection_name: string
 		throw error;
 	}
 
+	// the collection only exists once its ingestion job is done
+	if (res && res.job_id) {
+		await waitForIngestionJob(token, res.job_id, onProgress);
+	}
+
 	return res;
 };
 
+export const waitForIngestionJob = async (
+	token: string,
+	job_id: string,
+	onProgress: Function | null = null
+) => {
+	let error = null;
+	let job = null;
+
+	const res = await fetch(`${RAG_API_BASE_URL}/doc/jobs/${job_id}/events`, {
+		method: 'GET',
+		headers: {
+			Accept: 'text/event-stream',
+			authorization: `Bearer ${token}`
+		}
+	}).catch((err) => {
+		console.log(err);
+		error = err;
+		return null;
+	});
+
+	if (res && res.ok) {
+		const reader = res.body
+			.pipeThrough(new TextDecoderStream())
+			.pipeThrough(splitStream('\n'))
+			.getReader();
+
+		while (true) {
+			const { value, done } = await reader.read();
+			if (done) break;
+
+			for (const line of value.split('\n')) {
+				if (line.startsWith('data: ')) {
+					job = JSON.parse(line.replace(/^data: /, ''));
+					if (onProgress) {
+						onProgress(job);
+					}
+				}
+			}
+		}
+	} else if (res) {
+		error = (await res.json()).detail;
+	}
+
+	if (job && job.status === 'failed') {
+		error = job.error;
+	} else if (!error && (!job || job.status !== 'done')) {
+		error = 'Document ingestion did not finish';
+	}
+
+	if (error) {
+		throw error;
+	}
+
+	return job;
+};
+
 export const uploadWebToVectorDB = async (token: string, collection_name: string, url: string) => {
 	let error = null;
 